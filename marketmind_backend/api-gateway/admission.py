@@ -0,0 +1,146 @@
+import os
+import math
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from common.metrics import Histogram
+
+# Admission control configuration for /api/generate
+GENERATE_MAX_CONCURRENCY = int(os.environ.get('GENERATE_MAX_CONCURRENCY', '8'))
+GENERATE_MAX_QUEUE = int(os.environ.get('GENERATE_MAX_QUEUE', '32'))
+GENERATE_MAX_QUEUE_WAIT = float(os.environ.get('GENERATE_MAX_QUEUE_WAIT', '10'))
+
+WAIT_TIME_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is turned away instead of being queued or run"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Concurrency limit with a bounded FIFO wait queue.
+    Requests beyond the limit wait for a slot up to max_wait seconds;
+    when the queue itself is full they are rejected right away.
+    A request can take several slots (at most all of them), e.g. one per image of a batch.
+    """
+
+    def __init__(self, name, max_concurrency=GENERATE_MAX_CONCURRENCY,
+                 max_queue=GENERATE_MAX_QUEUE, max_wait=GENERATE_MAX_QUEUE_WAIT):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queue = deque()
+        self._service_time = 0.0
+        self._admitted = 0
+        self._rejected_full = 0
+        self._rejected_timeout = 0
+        self._rejected_deadline = 0
+        self.wait_time = Histogram(WAIT_TIME_BUCKETS)
+        self.queue_depth_on_arrival = Histogram(QUEUE_DEPTH_BUCKETS)
+
+    def _retry_after(self):
+        """Estimate seconds until the queue drains enough to accept a new request"""
+        per_slot = self._service_time or 1.0
+        return max(1, math.ceil(per_slot * (len(self._queue) + 1) / self.max_concurrency))
+
+    def slots_for(self, weight):
+        """Slots a request of that weight holds"""
+        return max(1, min(weight, self.max_concurrency))
+
+    def acquire(self, timeout=None, weight=1):
+        """
+        Take `weight` slots, waiting in the queue if needed, and return the time waited.
+        A timeout shorter than max_wait (such as the request's remaining deadline)
+        bounds the wait, and running out of it is reported as 'deadline'.
+        """
+        slots = self.slots_for(weight)
+        deadline_bound = timeout is not None and timeout < self.max_wait
+        start = time.monotonic()
+        with self._lock:
+            self.queue_depth_on_arrival.observe(len(self._queue))
+            if self._active + slots <= self.max_concurrency and not self._queue:
+                self._active += slots
+                self._admitted += 1
+                self.wait_time.observe(0.0)
+                return 0.0
+            if len(self._queue) >= self.max_queue:
+                self._rejected_full += 1
+                raise AdmissionRejected("queue_full", self._retry_after())
+            waiter = threading.Event()
+            waiter.slots = slots
+            self._queue.append(waiter)
+
+        waiter.wait(max(0.0, timeout) if deadline_bound else self.max_wait)
+
+        with self._lock:
+            waited = time.monotonic() - start
+            # Slots handed over by release() are kept even if the wait timed out at the same moment
+            if not waiter.is_set():
+                self._queue.remove(waiter)
+                # A large waiter leaving the head of the queue may unblock smaller ones behind it
+                self._admit_waiters()
+                if deadline_bound:
+                    self._rejected_deadline += 1
+                    raise AdmissionRejected("deadline", self._retry_after())
+                self._rejected_timeout += 1
+                raise AdmissionRejected("queue_timeout", self._retry_after())
+            self._admitted += 1
+            self.wait_time.observe(waited)
+            return waited
+
+    def _admit_waiters(self):
+        """Hand free slots to the oldest waiters in order, called with the lock held"""
+        while self._queue and self._active + self._queue[0].slots <= self.max_concurrency:
+            waiter = self._queue.popleft()
+            self._active += waiter.slots
+            waiter.set()
+
+    def release(self, service_time=None, weight=1):
+        """Free the slots of a request, handing them straight to the oldest waiters"""
+        with self._lock:
+            if service_time is not None:
+                if self._service_time:
+                    self._service_time += 0.2 * (service_time - self._service_time)
+                else:
+                    self._service_time = service_time
+            self._active -= self.slots_for(weight)
+            self._admit_waiters()
+
+    @contextmanager
+    def admit(self, timeout=None, weight=1):
+        """Hold the slots for the duration of the block"""
+        self.acquire(timeout, weight)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start, weight)
+
+    def get_stats(self):
+        """Get admission statistics"""
+        with self._lock:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "max_wait": self.max_wait,
+                "active": self._active,
+                "queue_depth": len(self._queue),
+                "admitted": self._admitted,
+                "rejected_queue_full": self._rejected_full,
+                "rejected_queue_timeout": self._rejected_timeout,
+                "rejected_deadline": self._rejected_deadline,
+                "wait_time_seconds": self.wait_time.to_dict(),
+                "queue_depth_on_arrival": self.queue_depth_on_arrival.to_dict()
+            }
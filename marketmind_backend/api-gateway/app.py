@@ -1,7 +1,30 @@
 import os
-from flask import Flask, request, jsonify
+import sys
+import json
+import time
+from flask import Flask, g, request, jsonify, make_response
 import requests
 from flask_cors import CORS
+from werkzeug.wsgi import ClosingIterator
+
+# Shared modules live next to the service directories (copied to /app/common in Docker)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import deadline
+from common.identity import IDENTITY_HEADER, sign_identity
+from common.metrics import Metrics
+from common import tracing
+from upstream_pool import UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT, start_idle_reaper
+from streaming import PROXY_CHUNK_SIZE, iter_upstream_response, streaming_request_body
+from response_cache import CacheEntry, ResponseCache
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from load_balancer import ReplicaSet, parse_replica_urls, start_health_checker
+from admission import AdmissionController, AdmissionRejected
+from gateway_metrics import register_gateway_collectors
+from batch import INHERITED_HEADERS, BatchError, parse_batch, run_batch
+from hedging import HEDGED_UPSTREAMS, Hedger
+from edge_auth import EDGE_AUTH_ENABLED, EdgeAuthenticator
+from rate_limit import RATE_LIMIT_ENABLED, RateLimiter, RateLimitExceeded
+from compression import COMPRESSION_ENABLED, ResponseCompressor, accepts
 
 app = Flask(__name__)
 # CORS(app)
@@ -12,60 +35,367 @@ CORS(app, resources={
     r"/*": {
         "origins": ["http://localhost:3000"],
         "supports_credentials": True,
-        "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"]
+        "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+        # Metadata of raw image responses from /api/generate
+        "expose_headers": ["X-Image-Width", "X-Image-Height", "X-Image-Prompt"]
     }
 })  
 
 
-# Service URLs from environment variables
+# Service URLs from environment variables, a comma separated list for several replicas
 USER_SERVICE_URL = os.environ.get('USER_SERVICE_URL', 'http://localhost:5001')
 IMAGE_SERVICE_URL = os.environ.get('IMAGE_SERVICE_URL', 'http://localhost:5002')
 
+# Forward request and response bodies chunk by chunk instead of buffering them
+PROXY_STREAMING = os.environ.get('PROXY_STREAMING', 'true').lower() == 'true'
+
+# Upstream services, each balanced across its replicas
+upstreams = {
+    'user': ReplicaSet('user', parse_replica_urls(USER_SERVICE_URL)),
+    'image': ReplicaSet('image', parse_replica_urls(IMAGE_SERVICE_URL)),
+}
+start_health_checker(list(upstreams.values()))
+
+# Keep-alive connection pools, one per replica
+upstream_pools = {
+    replica.pool.name: replica.pool
+    for replica_set in upstreams.values()
+    for replica in replica_set.replicas
+}
+start_idle_reaper(list(upstream_pools.values()))
+
+# Time budget per route prefix; the tighter of the budget and a client supplied deadline is sent upstream
+DEADLINE_BUDGETS = deadline.parse_route_budgets(os.environ.get(
+    'DEADLINE_BUDGETS', '/api/generate=30,/api/images/generate/batch=60,/api/images=15,/api/users=5,/api/auth=5'))
+
+# Circuit breakers fail fast once an upstream is known to be unhealthy
+circuit_breakers = {name: CircuitBreaker(name) for name in upstreams}
+
+# Opt-in hedged requests for upstreams, limited to the HEDGED_ROUTES where a duplicate call is safe
+hedgers = {
+    name: Hedger(name) for name in (item.strip() for item in HEDGED_UPSTREAMS.split(','))
+    if name in upstreams
+}
+
+# Concurrency limit and bounded wait queue in front of CPU-heavy generation
+generate_admission = AdmissionController('generate')
+
+# Cache for idempotent GET responses such as status and health polling
+response_cache = ResponseCache()
+
+# JWTs are verified once here and services receive a signed identity instead
+edge_auth = EdgeAuthenticator()
+
+# Token buckets per route and client against floods of generation and login calls
+rate_limiter = RateLimiter()
+
+# Negotiated gzip, br or zstd for responses leaving the gateway
+response_compressor = ResponseCompressor()
+
+# Request count, errors, in-flight and latency per route and upstream, served at /metrics
+metrics = Metrics('api-gateway').init_app(app)
+
+# Server span per request, continued by the services through the traceparent header
+tracer = tracing.init_tracer('api-gateway')
+tracing.init_app(app, tracer)
+upstream_requests = metrics.counter(
+    'gateway_upstream_requests_total', 'Calls proxied to upstream replicas', ('upstream', 'replica', 'outcome'))
+upstream_latency = metrics.histogram(
+    'gateway_upstream_duration_seconds', 'Time until the upstream response headers arrived', ('upstream',))
+register_gateway_collectors(
+    metrics, upstreams, upstream_pools, circuit_breakers, response_cache,
+    {"generate": generate_admission}, hedgers, edge_auth, rate_limiter, response_compressor
+)
+deadline_exceeded = metrics.counter(
+    'deadline_exceeded_total', 'Requests dropped because their deadline passed', ('service', 'stage'))
+deadline.init_app(app, on_expired=lambda stage: deadline_exceeded.inc(service='api-gateway', stage=stage))
+
+@app.before_request
+def apply_deadline_budget():
+    """Start the request's deadline clock from its route budget"""
+    budget = deadline.budget_for(DEADLINE_BUDGETS, request.path)
+    if budget is not None:
+        budget_deadline = time.time() + budget
+        g.deadline = budget_deadline if g.deadline is None else min(g.deadline, budget_deadline)
+
+@app.before_request
+def authenticate_at_edge():
+    """Reject unauthenticated calls to protected routes before they reach a service"""
+    g.identity = None
+    if request.method == 'OPTIONS':
+        return None
+    auth_header = request.headers.get('Authorization', '')
+    token = auth_header.split(' ', 1)[1] if auth_header.startswith('Bearer ') else None
+    if token:
+        with tracer.span('verify_token'):
+            g.identity = edge_auth.verify(token)
+    if EDGE_AUTH_ENABLED and edge_auth.is_protected(request.path):
+        if not token:
+            return jsonify({"error": "Authentication required"}), 401
+        if g.identity is None:
+            return jsonify({"error": "Invalid or expired token"}), 401
+
+@app.before_request
+def enforce_rate_limit():
+    """Turn away clients that used up their bucket for the route, keyed by user or IP"""
+    g.rate_limit = None
+    if not RATE_LIMIT_ENABLED or request.method == 'OPTIONS':
+        return None
+    identity = g.get('identity')
+    if identity and identity.get('user_id'):
+        client_key = f"user:{identity['user_id']}"
+    else:
+        client_key = f"ip:{request.remote_addr}"
+    try:
+        g.rate_limit = rate_limiter.check(request.path, client_key)
+    except RateLimitExceeded as e:
+        return jsonify({"error": "Rate limit exceeded, retry later"}), 429, {
+            "Retry-After": str(e.retry_after),
+            "X-RateLimit-Limit": str(e.rule.capacity),
+            "X-RateLimit-Remaining": "0"
+        }
+
+@app.after_request
+def add_rate_limit_headers(response):
+    rule, tokens = g.get('rate_limit') or (None, None)
+    if rule is not None:
+        response.headers['X-RateLimit-Limit'] = str(rule.capacity)
+        response.headers['X-RateLimit-Remaining'] = str(int(tokens))
+    return response
+
+@app.after_request
+def compress_response(response):
+    if COMPRESSION_ENABLED:
+        response_compressor.compress(response, request.headers.get('Accept-Encoding'))
+    return response
+
+# Headers never forwarded upstream (a client cannot assert its own identity), and hop-by-hop headers never forwarded back
+EXCLUDED_REQUEST_HEADERS = ['host', 'content-length', 'transfer-encoding', IDENTITY_HEADER.lower()]
+EXCLUDED_RESPONSE_HEADERS = ['content-encoding', 'content-length', 'connection', 'transfer-encoding']
+
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "API Gateway is operational"})
 
+@app.route('/stats', methods=['GET'])
+def gateway_stats():
+    """Get gateway runtime statistics"""
+    return jsonify({
+        "pools": {name: pool.get_stats() for name, pool in upstream_pools.items()},
+        "upstreams": {name: replica_set.get_stats() for name, replica_set in upstreams.items()},
+        "cache": response_cache.get_stats(),
+        "breakers": {name: breaker.get_stats() for name, breaker in circuit_breakers.items()},
+        "admission": {"generate": generate_admission.get_stats()},
+        "hedging": {name: hedger.get_stats() for name, hedger in hedgers.items()},
+        "edge_auth": edge_auth.get_stats(),
+        "rate_limit": rate_limiter.get_stats(),
+        "compression": response_compressor.get_stats()
+    })
+
 # User Service Routes
 @app.route('/api/users/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE'])
 def user_service_proxy(path):
-    url = f"{USER_SERVICE_URL}/{path}"
-    return proxy_request(url)
+    return proxy_request('user', path)
 
 @app.route('/api/auth/<path:path>', methods=['GET', 'POST'])
 def auth_proxy(path):
-    url = f"{USER_SERVICE_URL}/{path}"  # ✅ Correct URL
-    return proxy_request(url)
+    return proxy_request('user', path)
 
 # Image Service Routes
+# Job submissions are not admission controlled: they are answered 202 at once and
+# rendered by the image service's own JOB_WORKERS, which bound their concurrency
 @app.route('/api/images/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE'])
 def image_service_proxy(path):
-    url = f"{IMAGE_SERVICE_URL}/{path}"
-    return proxy_request(url)
+    return proxy_request('image', path)
+
+def admission_rejected(e):
+    if e.reason == 'deadline':
+        deadline_exceeded.inc(service='api-gateway', stage='admission')
+        return jsonify({"error": "Deadline exceeded"}), 504
+    status = 429 if e.reason == 'queue_full' else 503
+    return jsonify({"error": "Too many generation requests, retry later"}), status, \
+        {"Retry-After": str(e.retry_after)}
 
 @app.route('/api/generate', methods=['POST'])
 def generate_image_proxy():
-    url = f"{IMAGE_SERVICE_URL}/generate"
-    return proxy_request(url)
+    try:
+        with generate_admission.admit(deadline.remaining(deadline.current_deadline())):
+            return proxy_request('image', 'generate')
+    except AdmissionRejected as e:
+        return admission_rejected(e)
 
-def proxy_request(url):
+@app.route('/api/images/generate/batch', methods=['POST'])
+def generate_batch_proxy():
+    """
+    A batch renders its items concurrently, so it takes one generation slot per item
+    (at most all of them) and holds them until its streamed results end.
+    """
+    # Read up front to count the items; batch bodies are small JSON documents
+    data = request.get_data()
     try:
-        response = requests.request(
-            method=request.method,
-            url=url,
-            headers={key: value for (key, value) in request.headers 
-                     if key.lower() not in ['host', 'content-length']},
-            data=request.get_data(),
-            cookies=request.cookies,
-            params=request.args,
-            allow_redirects=False
-        )
+        items = json.loads(data).get('items')
+    except (ValueError, AttributeError):
+        items = None
+    # The image service answers a malformed batch with 400, it only needs one slot for that
+    weight = len(items) if isinstance(items, list) and items else 1
 
-        # Forward headers excluding hop-by-hop headers
-        excluded_headers = ['content-encoding', 'content-length', 'connection']
-        headers = [
-            (name, value) for (name, value) in response.raw.headers.items()
-            if name.lower() not in excluded_headers
-        ]
+    try:
+        generate_admission.acquire(deadline.remaining(deadline.current_deadline()), weight=weight)
+    except AdmissionRejected as e:
+        return admission_rejected(e)
+    start = time.monotonic()
+    released = []
+
+    def release():
+        if not released:
+            released.append(True)
+            generate_admission.release(time.monotonic() - start, weight=weight)
+
+    try:
+        response = make_response(proxy_request('image', 'generate/batch', data=data))
+    except BaseException:
+        release()
+        raise
+    # Streamed bodies are passed to the server as they are, without the response's close callbacks;
+    # the server closes the body when it is done or the client went away, even if never read
+    response.response = ClosingIterator(response.response, release)
+    return response
+
+def send_upstream(service, path, data=None, stream=False, extra_headers=None):
+    """Send the current request to an upstream service over its pool"""
+    headers = {key: value for (key, value) in request.headers
+               if key.lower() not in EXCLUDED_REQUEST_HEADERS}
+    for key, value in (extra_headers or {}).items():
+        if value is None:
+            headers.pop(key, None)
+        else:
+            headers[key] = value
+
+    identity = g.get('identity')
+    signed_identity = sign_identity(identity) if identity is not None else None
+    if signed_identity is not None:
+        headers[IDENTITY_HEADER] = signed_identity
+
+    # The upstream learns the deadline, and the gateway stops waiting when it passes
+    read_timeout = UPSTREAM_READ_TIMEOUT
+    request_deadline = deadline.current_deadline()
+    if request_deadline is not None:
+        deadline.check_deadline(request_deadline, 'upstream')
+        headers[deadline.DEADLINE_HEADER] = deadline.format_deadline(request_deadline)
+        read_timeout = max(0.001, min(read_timeout, deadline.remaining(request_deadline)))
+
+    # Everything taken from the Flask request up front, hedged attempts run on other threads
+    call = {
+        "method": request.method,
+        "path": path,
+        "headers": headers,
+        "data": data,
+        "cookies": request.cookies,
+        "params": request.args,
+        "allow_redirects": False,
+        "stream": stream,
+        "timeout": (UPSTREAM_CONNECT_TIMEOUT, read_timeout)
+    }
+    replica_set = upstreams[service]
+    # Covers the hop until the response headers arrive, hedged attempts included
+    with tracer.span(f"proxy {service}", kind='client', upstream=service, path=path) as proxy_span:
+        tracing.inject(headers)
+        route = hedged_route(service)
+        if route is not None:
+            response = hedgers[service].run(replica_set, route, lambda replica: call_replica(service, replica, call))
+        else:
+            response = call_replica(service, replica_set.pick(), call)
+        proxy_span.set_attribute("http.status_code", response.status_code)
+        return response
+
+def hedged_route(service):
+    """The hedged route the current request belongs to, or None if it is sent once"""
+    if service not in hedgers:
+        return None
+    return hedgers[service].route_for(request.method, request.path)
+
+def call_replica(service, replica, call):
+    """Send a prepared call to one replica, accounting it in the breaker, balancer and metrics"""
+    breaker = circuit_breakers[service]
+    probe = breaker.before_call()
+    replica_set = upstreams[service]
+    replica_set.begin(replica)
+    start = time.monotonic()
+    try:
+        response = replica.pool.request(**call)
+    except Exception as e:
+        latency = time.monotonic() - start
+        # Running out of a client's short deadline says nothing about the upstream's health
+        deadline_cut = isinstance(e, requests.exceptions.ReadTimeout) and call["timeout"][1] < UPSTREAM_READ_TIMEOUT
+        replica_set.end(replica, latency, deadline_cut)
+        breaker.after_call(deadline_cut, latency, probe)
+        upstream_requests.inc(upstream=service, replica=replica.url, outcome='exception')
+        upstream_latency.observe(latency, upstream=service)
+        raise
+    latency = time.monotonic() - start
+    success = response.status_code < 500
+    replica_set.end(replica, latency, success)
+    breaker.after_call(success, latency, probe)
+    upstream_requests.inc(upstream=service, replica=replica.url, outcome='ok' if success else 'server_error')
+    upstream_latency.observe(latency, upstream=service)
+    return response
+
+def forward_headers(response):
+    """Upstream response headers excluding hop-by-hop headers"""
+    return [
+        (name, value) for (name, value) in response.raw.headers.items()
+        if name.lower() not in EXCLUDED_RESPONSE_HEADERS
+    ]
+
+# Batch Route
+@app.route('/api/batch', methods=['POST'])
+def batch_proxy():
+    """Fan a list of sub-requests out through the gateway routes and return all results"""
+    try:
+        sub_requests = parse_batch(request.get_json(silent=True))
+    except BatchError as e:
+        return jsonify({"error": str(e)}), 400
+
+    inherited_headers = {name: request.headers[name] for name in INHERITED_HEADERS if name in request.headers}
+    tracing.inject(inherited_headers)
+    responses = run_batch(app, sub_requests, inherited_headers, request.remote_addr)
+    return jsonify({"responses": responses})
+
+def proxy_request(service, path, data=None):
+    """Forward the current request upstream; `data` is its body when the route already read it"""
+    try:
+        ttl = response_cache.ttl_for(request.path) if request.method == 'GET' else 0
+        if ttl:
+            return cached_proxy_request(service, path, ttl)
+
+        # Hedged calls may be sent twice, so their body must be replayable
+        if data is None and PROXY_STREAMING and hedged_route(service) is None:
+            data = streaming_request_body(request)
+        elif data is None:
+            data = request.get_data()
+
+        response = send_upstream(service, path, data=data, stream=PROXY_STREAMING)
+        headers = forward_headers(response)
+
+        if PROXY_STREAMING:
+            # A body the upstream already compressed in a coding the client accepts is passed through as is
+            content_encoding = response.headers.get('Content-Encoding')
+            passthrough = bool(content_encoding) and accepts(request.headers.get('Accept-Encoding'), content_encoding)
+            if passthrough:
+                headers.append(('Content-Encoding', content_encoding))
+                response_compressor.record_passthrough()
+
+            # The length is only still valid if requests does not decode the body
+            content_length = response.headers.get('Content-Length')
+            if content_length and (passthrough or not content_encoding):
+                headers.append(('Content-Length', content_length))
+
+            return app.response_class(
+                response=iter_upstream_response(response, PROXY_CHUNK_SIZE, decode_content=not passthrough),
+                status=response.status_code,
+                headers=dict(headers),
+                direct_passthrough=True
+            )
 
         content = response.content
         if not content:
@@ -80,10 +410,67 @@ def proxy_request(url):
 
         return proxy_response
 
+    except CircuitOpenError as e:
+        return jsonify({"error": "Service unavailable"}), 503, {"Retry-After": str(max(1, int(e.retry_after)))}
+    except deadline.DeadlineExceeded:
+        raise
+    except requests.exceptions.ReadTimeout:
+        return jsonify({"error": "Service timed out"}), 504
     except requests.exceptions.ConnectionError:
         return jsonify({"error": "Service unavailable"}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def cached_proxy_request(service, path, ttl):
+    """Serve a GET from the response cache, revalidating stale entries upstream"""
+    key = ResponseCache.make_key(
+        request.method,
+        request.path,
+        request.query_string.decode(),
+        request.headers.get('Authorization')
+    )
+    entry = response_cache.get(key)
+    if entry is not None and entry.is_fresh():
+        response_cache.record('hits')
+        return cached_response(entry, 'HIT')
+
+    # Client validators are answered by the gateway, only the cache's own ETag goes upstream
+    response = send_upstream(service, path, extra_headers={
+        'If-None-Match': entry.etag if entry is not None else None,
+        'If-Modified-Since': None
+    })
+    if entry is not None and response.status_code == 304:
+        entry.refresh()
+        response_cache.record('revalidated')
+        return cached_response(entry, 'REVALIDATED')
+
+    response_cache.record('misses')
+    headers = forward_headers(response)
+    content = response.content or b''
+
+    cache_control = response.headers.get('Cache-Control', '').lower()
+    if response.status_code != 200 or 'no-store' in cache_control or 'Set-Cookie' in response.headers:
+        return app.response_class(response=content, status=response.status_code, headers=dict(headers))
+
+    etag = response.headers.get('ETag') or ResponseCache.compute_etag(content)
+    headers = [(name, value) for (name, value) in headers if name.lower() != 'etag']
+    headers.append(('ETag', etag))
+    entry = CacheEntry(response.status_code, headers, content, etag, ttl)
+    response_cache.put(key, entry)
+    return cached_response(entry, 'MISS')
+
+def cached_response(entry, cache_status):
+    """Build a response from a cache entry, answering If-None-Match with 304"""
+    proxy_response = app.response_class(
+        response=entry.body,
+        status=entry.status,
+        headers=dict(entry.headers)
+    )
+    proxy_response.headers['X-Cache'] = cache_status
+    proxy_response.make_conditional(request)
+    if proxy_response.status_code == 304:
+        response_cache.record('not_modified')
+    return proxy_response
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8000)
\ No newline at end of file
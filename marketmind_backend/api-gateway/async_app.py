@@ -0,0 +1,245 @@
+import os
+import sys
+import time
+import asyncio
+import httpx
+from quart import Quart, g, request, jsonify
+from quart_cors import cors
+
+# Shared modules live next to the service directories (copied to /app/common in Docker)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.identity import IDENTITY_HEADER, sign_identity
+from upstream_pool import (UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_POOL_IDLE_TIMEOUT, UPSTREAM_POOL_SIZE,
+                           UPSTREAM_READ_TIMEOUT)
+from streaming import PROXY_CHUNK_SIZE
+from load_balancer import ReplicaSet, parse_replica_urls, start_health_checker
+from edge_auth import EDGE_AUTH_ENABLED, EdgeAuthenticator
+
+# Asyncio gateway engine with the same route table as app.py, but only its proxying,
+# load balancing and edge authentication; see the README before running it in production.
+# Run with: hypercorn async_app:app --bind 0.0.0.0:8000
+app = Quart(__name__)
+app = cors(
+    app,
+    allow_origin=["http://localhost:3000"],
+    allow_credentials=True,
+    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"]
+)
+
+
+# Service URLs from environment variables, a comma separated list for several replicas
+USER_SERVICE_URL = os.environ.get('USER_SERVICE_URL', 'http://localhost:5001')
+IMAGE_SERVICE_URL = os.environ.get('IMAGE_SERVICE_URL', 'http://localhost:5002')
+
+# Upstream services, each balanced across its replicas
+upstreams = {
+    'user': ReplicaSet('user', parse_replica_urls(USER_SERVICE_URL)),
+    'image': ReplicaSet('image', parse_replica_urls(IMAGE_SERVICE_URL)),
+}
+
+# JWTs are verified once here and services receive a signed identity instead
+edge_auth = EdgeAuthenticator()
+
+# Maximum number of proxied calls in flight, and how long a call may wait for a slot
+GATEWAY_MAX_IN_FLIGHT = int(os.environ.get('GATEWAY_MAX_IN_FLIGHT', '2000'))
+GATEWAY_ACQUIRE_TIMEOUT = float(os.environ.get('GATEWAY_ACQUIRE_TIMEOUT', '5'))
+
+
+class InFlightLimiter:
+    """Bounds the number of concurrent upstream calls handled by the event loop"""
+
+    def __init__(self, limit, acquire_timeout):
+        self.limit = limit
+        self.acquire_timeout = acquire_timeout
+        self._semaphore = asyncio.Semaphore(limit)
+        self.in_flight = 0
+        self.waiting = 0
+        self.requests = 0
+        self.rejected = 0
+
+    async def acquire(self):
+        """Wait for a free slot, return False if none frees up in time"""
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return False
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.requests += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def get_stats(self):
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "requests": self.requests,
+            "rejected": self.rejected
+        }
+
+
+upstream_client = None
+limiter = None
+
+@app.before_serving
+async def start_clients():
+    """Create the async HTTP client and limiter on the serving event loop"""
+    global upstream_client, limiter
+    limits = httpx.Limits(
+        max_connections=GATEWAY_MAX_IN_FLIGHT,
+        max_keepalive_connections=UPSTREAM_POOL_SIZE,
+        keepalive_expiry=UPSTREAM_POOL_IDLE_TIMEOUT
+    )
+    # Same timeouts as app.py, a hung upstream must not hold an in-flight slot forever
+    timeout = httpx.Timeout(UPSTREAM_READ_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT)
+    upstream_client = httpx.AsyncClient(limits=limits, timeout=timeout)
+    limiter = InFlightLimiter(GATEWAY_MAX_IN_FLIGHT, GATEWAY_ACQUIRE_TIMEOUT)
+    start_health_checker(list(upstreams.values()))
+
+@app.after_serving
+async def close_clients():
+    await upstream_client.aclose()
+
+@app.before_request
+async def authenticate_at_edge():
+    """Reject unauthenticated calls to protected routes before they reach a service"""
+    g.identity = None
+    if request.method == 'OPTIONS':
+        return None
+    auth_header = request.headers.get('Authorization', '')
+    token = auth_header.split(' ', 1)[1] if auth_header.startswith('Bearer ') else None
+    if token:
+        g.identity = edge_auth.verify(token)
+    if EDGE_AUTH_ENABLED and edge_auth.is_protected(request.path):
+        if not token:
+            return jsonify({"error": "Authentication required"}), 401
+        if g.identity is None:
+            return jsonify({"error": "Invalid or expired token"}), 401
+
+# Headers never forwarded upstream (a client cannot assert its own identity)
+EXCLUDED_REQUEST_HEADERS = ['host', 'content-length', 'transfer-encoding', IDENTITY_HEADER.lower()]
+
+@app.route('/health', methods=['GET'])
+async def health_check():
+    return jsonify({"status": "API Gateway is operational"})
+
+@app.route('/stats', methods=['GET'])
+async def gateway_stats():
+    """Get gateway runtime statistics"""
+    return jsonify({
+        "engine": "asyncio",
+        "in_flight": limiter.get_stats(),
+        "edge_auth": edge_auth.get_stats(),
+        "upstreams": {name: replica_set.get_stats() for name, replica_set in upstreams.items()}
+    })
+
+# User Service Routes
+@app.route('/api/users/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE'])
+async def user_service_proxy(path):
+    return await proxy_request('user', path)
+
+@app.route('/api/auth/<path:path>', methods=['GET', 'POST'])
+async def auth_proxy(path):
+    return await proxy_request('user', path)
+
+# Image Service Routes
+@app.route('/api/images/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE'])
+async def image_service_proxy(path):
+    return await proxy_request('image', path)
+
+@app.route('/api/generate', methods=['POST'])
+async def generate_image_proxy():
+    return await proxy_request('image', 'generate')
+
+async def iter_request_body():
+    """Yield the incoming request body without loading it whole"""
+    async for chunk in request.body:
+        if chunk:
+            yield chunk
+
+async def proxy_request(service, path):
+    if not await limiter.acquire():
+        return jsonify({"error": "Gateway overloaded"}), 503
+
+    released = False
+    try:
+        headers = {key: value for (key, value) in request.headers.items()
+                   if key.lower() not in EXCLUDED_REQUEST_HEADERS}
+        signed_identity = sign_identity(g.identity) if g.identity is not None else None
+        if signed_identity is not None:
+            headers[IDENTITY_HEADER] = signed_identity
+        if request.content_length:
+            # Lets httpx send a sized body instead of chunked encoding
+            headers['Content-Length'] = str(request.content_length)
+        has_body = bool(request.content_length) or \
+            request.headers.get('Transfer-Encoding', '').lower() == 'chunked'
+
+        replica_set = upstreams[service]
+        replica = replica_set.pick()
+        upstream_request = upstream_client.build_request(
+            method=request.method,
+            url=f"{replica.url}/{path}",
+            headers=headers,
+            params=list(request.args.items(multi=True)),
+            content=iter_request_body() if has_body else None
+        )
+        replica_set.begin(replica)
+        start = time.monotonic()
+        try:
+            response = await upstream_client.send(upstream_request, stream=True)
+        except Exception:
+            replica_set.end(replica, time.monotonic() - start, False)
+            raise
+        replica_set.end(replica, time.monotonic() - start, response.status_code < 500)
+
+        # Forward headers excluding hop-by-hop headers
+        excluded_headers = ['content-encoding', 'content-length', 'connection', 'transfer-encoding']
+        response_headers = [
+            (name, value) for (name, value) in response.headers.multi_items()
+            if name.lower() not in excluded_headers
+        ]
+        # The length is only still valid if httpx does not decode the body
+        if 'content-length' in response.headers and 'content-encoding' not in response.headers:
+            response_headers.append(('Content-Length', response.headers['content-length']))
+
+        async def iter_response():
+            try:
+                async for chunk in response.aiter_bytes(PROXY_CHUNK_SIZE):
+                    yield chunk
+            finally:
+                await response.aclose()
+                limiter.release()
+
+        released = True
+        return app.response_class(
+            iter_response(),
+            status=response.status_code,
+            headers=response_headers
+        )
+
+    except httpx.ConnectError:
+        return jsonify({"error": "Service unavailable"}), 503
+    except httpx.TimeoutException:
+        return jsonify({"error": "Service timed out"}), 504
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if not released:
+            limiter.release()
+
+if __name__ == '__main__':
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = ['0.0.0.0:8000']
+    # Accept bursts of connections up to the in-flight limit
+    config.backlog = GATEWAY_MAX_IN_FLIGHT
+    asyncio.run(serve(app, config))
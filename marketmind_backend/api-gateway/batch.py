@@ -0,0 +1,100 @@
+import os
+import json
+import base64
+from concurrent.futures import ThreadPoolExecutor
+from common.deadline import DEADLINE_HEADER
+
+# Batch configuration from environment variables
+BATCH_MAX_REQUESTS = int(os.environ.get('BATCH_MAX_REQUESTS', '20'))
+BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', '32'))
+
+# Methods the gateway routes accept
+BATCH_METHODS = ('GET', 'POST', 'PUT', 'DELETE')
+
+# Headers of the batch request that every sub-request inherits unless it sets its own
+INHERITED_HEADERS = ['Authorization', 'Cookie', 'Accept-Language', 'X-Forwarded-For', DEADLINE_HEADER]
+
+# Shared by every batch so fan-out stays bounded across concurrent batches
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix='batch')
+
+
+class BatchError(Exception):
+    """Raised when the batch envelope itself is invalid"""
+
+
+def parse_batch(data):
+    """Validate a batch request body and return its list of sub-requests"""
+    if not isinstance(data, dict) or not isinstance(data.get('requests'), list):
+        raise BatchError("Expected a JSON object with a 'requests' list")
+    sub_requests = data['requests']
+    if not sub_requests:
+        raise BatchError("No requests provided")
+    if len(sub_requests) > BATCH_MAX_REQUESTS:
+        raise BatchError(f"At most {BATCH_MAX_REQUESTS} requests per batch")
+    for index, sub_request in enumerate(sub_requests):
+        if not isinstance(sub_request, dict) or not isinstance(sub_request.get('path'), str) \
+                or not sub_request['path'].startswith('/'):
+            raise BatchError(f"Request {index} needs an absolute 'path'")
+        if sub_request['path'].split('?')[0].rstrip('/') == '/api/batch':
+            raise BatchError("Batches cannot be nested")
+        method = sub_request.get('method', 'GET')
+        if not isinstance(method, str) or method.upper() not in BATCH_METHODS:
+            raise BatchError(f"Request {index} 'method' must be one of {', '.join(BATCH_METHODS)}")
+        headers = sub_request.get('headers')
+        if headers is not None and (not isinstance(headers, dict) or not all(
+                isinstance(name, str) and isinstance(value, str) for name, value in headers.items())):
+            raise BatchError(f"Request {index} 'headers' must be an object of strings")
+    return sub_requests
+
+
+def encode_body(response):
+    """Decode a sub-response body as JSON, text or base64"""
+    # Streamed proxy responses are collected here rather than passed through
+    response.direct_passthrough = False
+    data = response.get_data()
+    if response.is_json:
+        try:
+            return json.loads(data), None
+        except ValueError:
+            pass
+    if response.mimetype.startswith('text/') or not data:
+        return data.decode('utf-8', errors='replace'), None
+    return base64.b64encode(data).decode(), 'base64'
+
+
+def dispatch(app, sub_request, inherited_headers, remote_addr):
+    """Run one sub-request through the gateway's own routing"""
+    result = {"id": sub_request.get('id')}
+    try:
+        headers = dict(inherited_headers)
+        headers.update(sub_request.get('headers') or {})
+        method = sub_request.get('method', 'GET').upper()
+        kwargs = {}
+        if 'body' in sub_request:
+            kwargs['json'] = sub_request['body']
+        with app.test_request_context(sub_request['path'], method=method, headers=headers,
+                                      environ_base={'REMOTE_ADDR': remote_addr}, **kwargs):
+            response = app.full_dispatch_request()
+            try:
+                body, encoding = encode_body(response)
+            finally:
+                response.close()
+        result.update({
+            "status": response.status_code,
+            "headers": {"Content-Type": response.content_type},
+            "body": body
+        })
+        if encoding:
+            result["body_encoding"] = encoding
+    except Exception as e:
+        result.update({"status": 500, "body": {"error": str(e)}})
+    return result
+
+
+def run_batch(app, sub_requests, inherited_headers, remote_addr):
+    """Fan sub-requests out concurrently and return their results in order"""
+    futures = [
+        batch_executor.submit(dispatch, app, sub_request, inherited_headers, remote_addr)
+        for sub_request in sub_requests
+    ]
+    return [future.result() for future in futures]
@@ -0,0 +1,143 @@
+import os
+import time
+import threading
+from collections import deque
+
+# Breaker configuration from environment variables
+BREAKER_WINDOW_SECONDS = float(os.environ.get('BREAKER_WINDOW_SECONDS', '30'))
+BREAKER_MIN_CALLS = int(os.environ.get('BREAKER_MIN_CALLS', '10'))
+BREAKER_FAILURE_RATE = float(os.environ.get('BREAKER_FAILURE_RATE', '0.5'))
+BREAKER_SLOW_CALL_SECONDS = float(os.environ.get('BREAKER_SLOW_CALL_SECONDS', '10'))
+BREAKER_SLOW_CALL_RATE = float(os.environ.get('BREAKER_SLOW_CALL_RATE', '0.8'))
+BREAKER_OPEN_SECONDS = float(os.environ.get('BREAKER_OPEN_SECONDS', '15'))
+BREAKER_HALF_OPEN_PROBES = int(os.environ.get('BREAKER_HALF_OPEN_PROBES', '3'))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the upstream is known to be unhealthy"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"Circuit open for {name}")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Per-upstream circuit breaker.
+    Trips open when the failure rate or slow-call rate over a rolling window
+    crosses its threshold, rejects calls while open, then lets a few probe
+    calls through (half-open) to decide whether to close again.
+    """
+
+    def __init__(self, name, window_seconds=BREAKER_WINDOW_SECONDS, min_calls=BREAKER_MIN_CALLS,
+                 failure_rate=BREAKER_FAILURE_RATE, slow_call_seconds=BREAKER_SLOW_CALL_SECONDS,
+                 slow_call_rate=BREAKER_SLOW_CALL_RATE, open_seconds=BREAKER_OPEN_SECONDS,
+                 half_open_probes=BREAKER_HALF_OPEN_PROBES):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        # (timestamp, failed, slow) for every call in the rolling window
+        self._calls = deque()
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self._stats = {"rejected": 0, "opened": 0, "failures": 0, "slow_calls": 0}
+
+    def _prune(self, now):
+        while self._calls and now - self._calls[0][0] > self.window_seconds:
+            self._calls.popleft()
+
+    def _trip(self, now):
+        self._state = OPEN
+        self._opened_at = now
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self._stats["opened"] += 1
+
+    def before_call(self):
+        """Admit a call or raise CircuitOpenError, return True if the call is a half-open probe"""
+        with self._lock:
+            now = time.monotonic()
+            if self._state == OPEN:
+                remaining = self._opened_at + self.open_seconds - now
+                if remaining > 0:
+                    self._stats["rejected"] += 1
+                    raise CircuitOpenError(self.name, remaining)
+                self._state = HALF_OPEN
+            if self._state == HALF_OPEN:
+                if self._probes_in_flight + self._probe_successes >= self.half_open_probes:
+                    self._stats["rejected"] += 1
+                    raise CircuitOpenError(self.name, self.open_seconds)
+                self._probes_in_flight += 1
+                return True
+            return False
+
+    def after_call(self, success, latency, probe=False):
+        """Record the outcome of an admitted call"""
+        with self._lock:
+            now = time.monotonic()
+            slow = latency >= self.slow_call_seconds
+            if not success:
+                self._stats["failures"] += 1
+            if slow:
+                self._stats["slow_calls"] += 1
+
+            if probe:
+                if self._state != HALF_OPEN:
+                    return
+                self._probes_in_flight -= 1
+                if not success or slow:
+                    self._trip(now)
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_probes:
+                    self._state = CLOSED
+                    self._calls.clear()
+                return
+
+            if self._state != CLOSED:
+                # Calls admitted before the breaker tripped do not count
+                return
+
+            self._calls.append((now, not success, slow))
+            self._prune(now)
+            total = len(self._calls)
+            if total < self.min_calls:
+                return
+            failed = sum(1 for call in self._calls if call[1])
+            slow_calls = sum(1 for call in self._calls if call[2])
+            if failed / total >= self.failure_rate or slow_calls / total >= self.slow_call_rate:
+                self._trip(now)
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() >= self._opened_at + self.open_seconds:
+                return HALF_OPEN
+            return self._state
+
+    def get_stats(self):
+        """Get breaker statistics"""
+        state = self.state
+        with self._lock:
+            self._prune(time.monotonic())
+            total = len(self._calls)
+            failed = sum(1 for call in self._calls if call[1])
+            return dict(self._stats, **{
+                "state": state,
+                "window_calls": total,
+                "window_failure_rate": round(failed / total, 4) if total else 0.0
+            })
@@ -0,0 +1,226 @@
+import os
+import zlib
+import threading
+
+try:
+    import brotli
+except ImportError:  # br is only offered when the brotli package is installed
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # zstd is only offered when the zstandard package is installed
+    zstandard = None
+
+# Compression configuration from environment variables
+COMPRESSION_ENABLED = os.environ.get('COMPRESSION_ENABLED', 'true').lower() == 'true'
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', '1024'))
+COMPRESSION_TYPES = os.environ.get(
+    'COMPRESSION_TYPES', 'application/json,text/,application/javascript,application/x-ndjson,image/svg+xml')
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '4'))
+COMPRESSION_ZSTD_LEVEL = int(os.environ.get('COMPRESSION_ZSTD_LEVEL', '3'))
+
+
+def available_encodings():
+    """Encodings this gateway can produce, most preferred first"""
+    encodings = []
+    if zstandard is not None:
+        encodings.append('zstd')
+    if brotli is not None:
+        encodings.append('br')
+    encodings.append('gzip')
+    return encodings
+
+
+def parse_accept_encoding(header):
+    """Parse an Accept-Encoding header into {coding: q}"""
+    codings = {}
+    for item in (header or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        codings[coding] = q
+    return codings
+
+
+def accepts(header, coding):
+    """Whether a client with this Accept-Encoding header can decode a coding"""
+    codings = parse_accept_encoding(header)
+    q = codings.get(coding.lower(), codings.get('*', 0.0))
+    return q > 0
+
+
+def negotiate(header, encodings=None):
+    """Pick the encoding to use for a client, or None to send the body as is"""
+    codings = parse_accept_encoding(header)
+    best, best_q = None, 0.0
+    for encoding in encodings or available_encodings():
+        q = codings.get(encoding, codings.get('*', 0.0))
+        # Server preference order breaks ties
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class _ZlibCompressor:
+    def __init__(self, level):
+        # wbits 31 writes the gzip container
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def sync(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def flush(self):
+        return self._compressor.flush()
+
+
+class _BrotliCompressor:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def sync(self):
+        return self._compressor.flush()
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+class _ZstdCompressor:
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def sync(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def flush(self):
+        return self._compressor.flush()
+
+
+def make_compressor(encoding):
+    """Create an incremental compressor with compress(data), sync() and flush()"""
+    if encoding == 'zstd':
+        return _ZstdCompressor(COMPRESSION_ZSTD_LEVEL)
+    if encoding == 'br':
+        return _BrotliCompressor(COMPRESSION_BROTLI_QUALITY)
+    return _ZlibCompressor(COMPRESSION_GZIP_LEVEL)
+
+
+class ResponseCompressor:
+    """
+    Compresses gateway responses with the best encoding the client accepts.
+    Small bodies, content types outside the allowlist and bodies that already
+    carry a Content-Encoding (passed through from upstream) are left alone.
+    """
+
+    def __init__(self, min_bytes=COMPRESSION_MIN_BYTES, types=COMPRESSION_TYPES):
+        self.min_bytes = min_bytes
+        self.types = [content_type.strip() for content_type in types.split(',') if content_type.strip()]
+
+        self._lock = threading.Lock()
+        self._stats = {"compressed": 0, "passthrough": 0, "skipped": 0}
+        self._bytes = {}  # encoding -> [bytes in, bytes out]
+
+    def _record(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _record_bytes(self, encoding, bytes_in, bytes_out):
+        with self._lock:
+            totals = self._bytes.setdefault(encoding, [0, 0])
+            totals[0] += bytes_in
+            totals[1] += bytes_out
+
+    def record_passthrough(self):
+        """Count a body forwarded still compressed by the upstream"""
+        self._record("passthrough")
+
+    def _compressible(self, response):
+        if response.status_code < 200 or response.status_code in (204, 304):
+            return False
+        if 'Content-Encoding' in response.headers:
+            return False
+        if 'no-transform' in response.headers.get('Cache-Control', '').lower():
+            return False
+        mimetype = response.mimetype or ''
+        if not any(mimetype.startswith(content_type) for content_type in self.types):
+            return False
+        # Streamed bodies of unknown length are assumed large enough
+        length = response.content_length
+        return length is None or length >= self.min_bytes
+
+    def compress(self, response, accept_encoding):
+        """Compress a Flask response in place if the client and the body allow it"""
+        response.vary.add('Accept-Encoding')
+        if 'Content-Encoding' in response.headers:
+            return response
+        encoding = negotiate(accept_encoding)
+        if encoding is None or not self._compressible(response):
+            self._record("skipped")
+            return response
+
+        if response.direct_passthrough or response.is_streamed:
+            response.response = self._compress_stream(response.response, encoding)
+            response.direct_passthrough = False
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            compressor = make_compressor(encoding)
+            compressed = compressor.compress(data) + compressor.flush()
+            self._record_bytes(encoding, len(data), len(compressed))
+            response.set_data(compressed)
+
+        response.headers['Content-Encoding'] = encoding
+        # A compressed body is a different representation of the same resource
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        self._record("compressed")
+        return response
+
+    def _compress_stream(self, chunks, encoding):
+        compressor = make_compressor(encoding)
+        bytes_in = bytes_out = 0
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                bytes_in += len(chunk)
+                # Flush every chunk so streamed bodies keep reaching the client as they arrive
+                data = compressor.compress(chunk) + compressor.sync()
+                if data:
+                    bytes_out += len(data)
+                    yield data
+            data = compressor.flush()
+            bytes_out += len(data)
+            yield data
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+            self._record_bytes(encoding, bytes_in, bytes_out)
+
+    def get_stats(self):
+        """Get compression statistics"""
+        with self._lock:
+            return dict(self._stats, encodings={
+                encoding: {"bytes_in": totals[0], "bytes_out": totals[1], "bytes_saved": totals[0] - totals[1]}
+                for encoding, totals in self._bytes.items()
+            }, available=available_encodings())
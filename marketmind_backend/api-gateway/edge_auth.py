@@ -0,0 +1,81 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import jwt
+
+# Edge authentication configuration from environment variables
+JWT_SECRET = os.environ.get('JWT_SECRET', 'your_jwt_secret_key_here')
+EDGE_AUTH_ENABLED = os.environ.get('EDGE_AUTH_ENABLED', 'true').lower() == 'true'
+EDGE_AUTH_PROTECTED = os.environ.get('EDGE_AUTH_PROTECTED', '/api/generate,/api/images/,/api/users/me,/api/auth/me')
+EDGE_AUTH_PUBLIC = os.environ.get('EDGE_AUTH_PUBLIC', '/api/images/health')
+EDGE_AUTH_CACHE_TTL = float(os.environ.get('EDGE_AUTH_CACHE_TTL', '60'))
+EDGE_AUTH_CACHE_SIZE = int(os.environ.get('EDGE_AUTH_CACHE_SIZE', '10000'))
+
+
+def parse_prefixes(value):
+    """Parse a comma separated list of path prefixes"""
+    return [prefix.strip() for prefix in value.split(',') if prefix.strip()]
+
+
+class EdgeAuthenticator:
+    """
+    Verifies JWTs once at the gateway.
+    Verified claims are cached by token hash until the earlier of the cache TTL
+    and the token's own expiry, so repeat calls skip signature verification.
+    """
+
+    def __init__(self, secret=JWT_SECRET, protected=EDGE_AUTH_PROTECTED, public=EDGE_AUTH_PUBLIC,
+                 ttl=EDGE_AUTH_CACHE_TTL, max_entries=EDGE_AUTH_CACHE_SIZE):
+        self.secret = secret
+        self.protected = parse_prefixes(protected)
+        self.public = parse_prefixes(public)
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._claims = OrderedDict()  # token hash -> (claims, expires_at)
+        self._stats = {"hits": 0, "misses": 0, "rejected": 0, "evictions": 0}
+
+    def is_protected(self, path):
+        """Whether a gateway path needs an authenticated caller"""
+        if any(path.startswith(prefix) for prefix in self.public):
+            return False
+        return any(path.startswith(prefix) for prefix in self.protected)
+
+    def verify(self, token):
+        """Return the token's claims, or None if it is invalid or expired"""
+        key = hashlib.sha256(token.encode()).hexdigest()
+        now = time.time()
+        with self._lock:
+            cached = self._claims.get(key)
+            if cached is not None and cached[1] > now:
+                self._claims.move_to_end(key)
+                self._stats["hits"] += 1
+                return cached[0]
+            self._stats["misses"] += 1
+
+        try:
+            claims = jwt.decode(token, self.secret, algorithms=['HS256'])
+        except jwt.InvalidTokenError:
+            with self._lock:
+                self._claims.pop(key, None)
+                self._stats["rejected"] += 1
+            return None
+
+        expires_at = now + self.ttl
+        if 'exp' in claims:
+            expires_at = min(expires_at, claims['exp'])
+        with self._lock:
+            self._claims[key] = (claims, expires_at)
+            self._claims.move_to_end(key)
+            while len(self._claims) > self.max_entries:
+                self._claims.popitem(last=False)
+                self._stats["evictions"] += 1
+        return claims
+
+    def get_stats(self):
+        """Get edge authentication statistics"""
+        with self._lock:
+            return dict(self._stats, entries=len(self._claims))
@@ -0,0 +1,142 @@
+import copy
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN
+
+BREAKER_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+def register_gateway_collectors(metrics, upstreams, upstream_pools, circuit_breakers,
+                                response_cache, admission_controllers, hedgers, edge_auth, rate_limiter,
+                                response_compressor):
+    """Export the gateway's upstream, cache, admission, auth, rate limit and compression state on /metrics"""
+
+    def collect_pools():
+        stats = {name: pool.get_stats() for name, pool in upstream_pools.items()}
+        families = []
+        for key, metric_type, help_text in [
+            ('requests', 'counter', 'Requests sent over the upstream pool'),
+            ('errors', 'counter', 'Requests that failed before a response was received'),
+            ('connections_opened', 'counter', 'TCP connections opened by the pool'),
+            ('idle_connections', 'gauge', 'Keep-alive connections currently idle in the pool'),
+            ('idle_evictions', 'counter', 'Times the pool was closed after sitting idle'),
+        ]:
+            families.append((
+                f"gateway_upstream_pool_{key}" + ('_total' if metric_type == 'counter' else ''),
+                metric_type,
+                help_text,
+                [({"pool": name}, pool_stats[key]) for name, pool_stats in stats.items()]
+            ))
+        return families
+
+    def collect_replicas():
+        in_flight, healthy, latency = [], [], []
+        for name, replica_set in upstreams.items():
+            for replica in replica_set.get_stats()["replicas"]:
+                labels = {"upstream": name, "replica": replica["url"]}
+                in_flight.append((labels, replica["in_flight"]))
+                healthy.append((labels, replica["healthy"]))
+                latency.append((labels, replica["ewma_latency_ms"] / 1000.0))
+        return [
+            ("gateway_replica_in_flight", "gauge", "Outstanding requests per upstream replica", in_flight),
+            ("gateway_replica_healthy", "gauge", "1 if the replica passes health checks", healthy),
+            ("gateway_replica_latency_seconds", "gauge", "Moving average latency per replica", latency),
+        ]
+
+    def collect_breakers():
+        state, rejected, opened = [], [], []
+        for name, breaker in circuit_breakers.items():
+            stats = breaker.get_stats()
+            labels = {"upstream": name}
+            state.append((labels, BREAKER_STATE_VALUES[stats["state"]]))
+            rejected.append((labels, stats["rejected"]))
+            opened.append((labels, stats["opened"]))
+        return [
+            ("gateway_breaker_state", "gauge", "Circuit state (0 closed, 1 half-open, 2 open)", state),
+            ("gateway_breaker_rejected_total", "counter", "Calls failed fast by an open circuit", rejected),
+            ("gateway_breaker_opened_total", "counter", "Times the circuit tripped open", opened),
+        ]
+
+    def collect_cache():
+        stats = response_cache.get_stats()
+        events = [({"event": event}, stats[event])
+                  for event in ("hits", "misses", "revalidated", "not_modified", "stores", "evictions")]
+        return [
+            ("gateway_cache_events_total", "counter", "Response cache lookups and maintenance events", events),
+            ("gateway_cache_bytes", "gauge", "Bytes held by the response cache", [({}, stats["bytes"])]),
+            ("gateway_cache_entries", "gauge", "Entries held by the response cache", [({}, stats["entries"])]),
+        ]
+
+    def collect_admission():
+        active, depth, rejected, wait_time, depth_on_arrival = [], [], [], [], []
+        for name, controller in admission_controllers.items():
+            stats = controller.get_stats()
+            labels = {"route": name}
+            active.append((labels, stats["active"]))
+            depth.append((labels, stats["queue_depth"]))
+            rejected.append((dict(labels, reason="queue_full"), stats["rejected_queue_full"]))
+            rejected.append((dict(labels, reason="queue_timeout"), stats["rejected_queue_timeout"]))
+            rejected.append((dict(labels, reason="deadline"), stats["rejected_deadline"]))
+            wait_time.append((labels, copy.deepcopy(controller.wait_time)))
+            depth_on_arrival.append((labels, copy.deepcopy(controller.queue_depth_on_arrival)))
+        return [
+            ("gateway_admission_active", "gauge", "Requests holding an admission slot", active),
+            ("gateway_admission_queue_depth", "gauge", "Requests waiting for an admission slot", depth),
+            ("gateway_admission_rejected_total", "counter", "Requests rejected by admission control", rejected),
+            ("gateway_admission_wait_seconds", "histogram", "Time spent waiting for an admission slot", wait_time),
+            ("gateway_admission_queue_depth_on_arrival", "histogram", "Queue depth seen by arriving requests",
+             depth_on_arrival),
+        ]
+
+    def collect_hedging():
+        events = []
+        for name, hedger in hedgers.items():
+            for event, count in hedger.get_stats().items():
+                events.append(({"upstream": name, "event": event}, count))
+        return [
+            ("gateway_hedging_events_total", "counter", "Primary calls, hedges sent, hedge wins and budget refusals",
+             events),
+        ]
+
+    def collect_edge_auth():
+        stats = edge_auth.get_stats()
+        events = [({"event": event}, stats[event]) for event in ("hits", "misses", "rejected", "evictions")]
+        return [
+            ("gateway_edge_auth_events_total", "counter", "Verified-claims cache lookups and rejected tokens", events),
+            ("gateway_edge_auth_cache_entries", "gauge", "Verified tokens held in the claims cache",
+             [({}, stats["entries"])]),
+        ]
+
+    def collect_rate_limit():
+        stats = rate_limiter.get_stats()
+        decisions = [({"route": route, "decision": "allowed"}, count) for route, count in stats["allowed"].items()]
+        decisions += [({"route": route, "decision": "limited"}, count) for route, count in stats["limited"].items()]
+        families = [
+            ("gateway_rate_limit_decisions_total", "counter", "Rate limited route calls allowed or rejected",
+             decisions),
+            ("gateway_rate_limit_backend_errors_total", "counter", "Calls let through because the backend failed",
+             [({}, stats["backend_errors"])]),
+        ]
+        if "keys" in stats:
+            families.append(("gateway_rate_limit_keys", "gauge", "Client buckets held in memory",
+                             [({}, stats["keys"])]))
+        return families
+
+    def collect_compression():
+        stats = response_compressor.get_stats()
+        responses = [({"outcome": outcome}, stats[outcome]) for outcome in ("compressed", "passthrough", "skipped")]
+        bytes_in, bytes_out, saved = [], [], []
+        for encoding, totals in stats["encodings"].items():
+            labels = {"encoding": encoding}
+            bytes_in.append((labels, totals["bytes_in"]))
+            bytes_out.append((labels, totals["bytes_out"]))
+            saved.append((labels, totals["bytes_saved"]))
+        return [
+            ("gateway_compression_responses_total", "counter", "Responses compressed, passed through or sent as is",
+             responses),
+            ("gateway_compression_bytes_in_total", "counter", "Response bytes before gateway compression", bytes_in),
+            ("gateway_compression_bytes_out_total", "counter", "Response bytes after gateway compression", bytes_out),
+            ("gateway_compression_bytes_saved_total", "counter", "Egress bytes saved by gateway compression", saved),
+        ]
+
+    for collector in (collect_pools, collect_replicas, collect_breakers, collect_cache, collect_admission,
+                      collect_hedging, collect_edge_auth, collect_rate_limit, collect_compression):
+        metrics.register_collector(collector)
@@ -0,0 +1,136 @@
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from load_balancer import LATENCY_SAMPLES
+from common.stats import percentile
+
+# Hedging configuration from environment variables
+HEDGED_UPSTREAMS = os.environ.get('HEDGED_UPSTREAMS', '')  # e.g. 'image'
+# Only calls safe to send twice are hedged, as 'METHOD /path' gateway routes
+HEDGED_ROUTES = os.environ.get('HEDGED_ROUTES', 'POST /api/generate')
+HEDGE_PERCENTILE = float(os.environ.get('HEDGE_PERCENTILE', '95'))
+HEDGE_MIN_DELAY = float(os.environ.get('HEDGE_MIN_DELAY', '0.05'))
+HEDGE_MIN_SAMPLES = int(os.environ.get('HEDGE_MIN_SAMPLES', '20'))
+HEDGE_BUDGET_PERCENT = float(os.environ.get('HEDGE_BUDGET_PERCENT', '10'))
+HEDGE_MAX_WORKERS = int(os.environ.get('HEDGE_MAX_WORKERS', '64'))
+
+# Runs both the primary and the hedged attempt so the caller can wait on either
+hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix='hedge')
+
+
+def parse_routes(value):
+    """Parse 'METHOD /path,...' into a set of (method, path) pairs"""
+    routes = set()
+    for item in value.split(','):
+        method, _, path = item.strip().partition(' ')
+        if method and path.strip():
+            routes.add((method.upper(), path.strip().rstrip('/') or '/'))
+    return routes
+
+
+def _close_response(future):
+    """Cancel a losing attempt by dropping its connection once it completes"""
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+class Hedger:
+    """
+    Hedged requests for one upstream service, limited to an allowlist of routes.
+    If the first replica has not answered within the route's recent latency percentile,
+    the same call is sent to a second replica and the first response wins.
+    Hedges are capped at a percentage of primary calls.
+    """
+
+    def __init__(self, name, routes=None, percentile=HEDGE_PERCENTILE, min_delay=HEDGE_MIN_DELAY,
+                 min_samples=HEDGE_MIN_SAMPLES, budget_percent=HEDGE_BUDGET_PERCENT):
+        self.name = name
+        self.routes = parse_routes(HEDGED_ROUTES) if routes is None else routes
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.budget_percent = budget_percent
+
+        self._lock = threading.Lock()
+        self._stats = {"primaries": 0, "hedges": 0, "hedge_wins": 0, "budget_exhausted": 0}
+        # Recent attempt latencies per route, routes differ too much to share a percentile
+        self._latencies = {route: deque(maxlen=LATENCY_SAMPLES) for route in self.routes}
+
+    def route_for(self, method, path):
+        """The allowlisted route a call belongs to, or None if it must not be hedged"""
+        route = (method.upper(), path.rstrip('/') or '/')
+        return route if route in self.routes else None
+
+    def hedge_delay(self, route):
+        """Delay before hedging, or None while there is too little latency history"""
+        with self._lock:
+            samples = list(self._latencies[route])
+        if len(samples) < self.min_samples:
+            return None
+        return max(self.min_delay, percentile(samples, self.percentile))
+
+    def _submit(self, executor, route, attempt, replica):
+        """Start an attempt, recording its latency for the route once it succeeds"""
+        start = time.monotonic()
+        future = executor.submit(attempt, replica)
+
+        def observe(done):
+            if not done.cancelled() and done.exception() is None:
+                with self._lock:
+                    self._latencies[route].append(time.monotonic() - start)
+
+        future.add_done_callback(observe)
+        return future
+
+    def _take_budget(self):
+        """Allow a hedge only while hedges stay within the budget share of primaries"""
+        with self._lock:
+            if self._stats["hedges"] + 1 > self._stats["primaries"] * self.budget_percent / 100.0:
+                self._stats["budget_exhausted"] += 1
+                return False
+            self._stats["hedges"] += 1
+            return True
+
+    def _record(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def run(self, replica_set, route, attempt, executor=hedge_executor):
+        """Call attempt(replica) on one replica, hedging to a second one if it is slow"""
+        self._record("primaries")
+        primary = replica_set.pick()
+        first = self._submit(executor, route, attempt, primary)
+
+        delay = self.hedge_delay(route)
+        if delay is None or wait([first], timeout=delay).done:
+            return first.result()
+
+        backup = replica_set.pick(exclude=primary)
+        if backup is primary or not backup.healthy or not self._take_budget():
+            return first.result()
+        second = self._submit(executor, route, attempt, backup)
+
+        winner = None
+        error = None
+        for future in as_completed([first, second]):
+            if future.exception() is not None:
+                error = future.exception()
+                continue
+            winner = future
+            break
+        if winner is None:
+            raise error
+
+        loser = second if winner is first else first
+        loser.cancel()
+        loser.add_done_callback(_close_response)
+        if winner is second:
+            self._record("hedge_wins")
+        return winner.result()
+
+    def get_stats(self):
+        """Get hedging statistics"""
+        with self._lock:
+            return dict(self._stats)
@@ -0,0 +1,161 @@
+import os
+import sys
+import time
+import random
+import threading
+from collections import deque
+import requests
+from requests.adapters import HTTPAdapter
+from upstream_pool import UpstreamPool
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.stats import percentile
+
+# Load balancing configuration from environment variables
+LB_STRATEGY = os.environ.get('LB_STRATEGY', 'least_outstanding')  # or 'p2c'
+HEALTH_CHECK_PATH = os.environ.get('HEALTH_CHECK_PATH', 'health')
+HEALTH_CHECK_INTERVAL = float(os.environ.get('HEALTH_CHECK_INTERVAL', '5'))
+HEALTH_CHECK_TIMEOUT = float(os.environ.get('HEALTH_CHECK_TIMEOUT', '1'))
+HEALTH_CHECK_FAILURES = int(os.environ.get('HEALTH_CHECK_FAILURES', '2'))
+
+# Number of recent latencies kept per replica for percentiles
+LATENCY_SAMPLES = 512
+# Weight of the newest sample in the moving average latency
+EWMA_ALPHA = 0.2
+
+
+def parse_replica_urls(value):
+    """Split a comma separated list of replica base URLs"""
+    return [url.strip().rstrip('/') for url in value.split(',') if url.strip()]
+
+
+class Replica:
+    """A single upstream replica with its own connection pool and load counters"""
+
+    def __init__(self, service, url):
+        self.service = service
+        self.url = url
+        self.pool = UpstreamPool(f"{service}@{url}", url)
+        self.healthy = True
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.ewma_latency = 0.0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+
+class ReplicaSet:
+    """
+    Routes calls for one upstream service across its replicas.
+    Picks the replica with the fewest outstanding requests (or the better of
+    two random choices with 'p2c') and skips replicas failing health checks.
+    """
+
+    def __init__(self, name, urls, strategy=LB_STRATEGY):
+        if not urls:
+            raise ValueError(f"No replicas configured for {name}")
+        self.name = name
+        self.strategy = strategy
+        self.replicas = [Replica(name, url) for url in urls]
+        self._lock = threading.Lock()
+        # Probes use their own connections, so they neither keep idle pools alive nor count as traffic
+        self._probe_session = requests.Session()
+        self._probe_session.trust_env = False
+        adapter = HTTPAdapter(pool_connections=len(self.replicas), pool_maxsize=1, max_retries=0)
+        self._probe_session.mount('http://', adapter)
+        self._probe_session.mount('https://', adapter)
+
+    @staticmethod
+    def _load(replica):
+        return (replica.in_flight, replica.ewma_latency)
+
+    def pick(self, exclude=None):
+        """Choose a replica for the next call"""
+        with self._lock:
+            candidates = [r for r in self.replicas if r.healthy and r is not exclude]
+            if not candidates:
+                # Fail open rather than reject everything when all replicas look down
+                candidates = [r for r in self.replicas if r is not exclude] or self.replicas
+            if len(candidates) == 1:
+                return candidates[0]
+            if self.strategy == 'p2c':
+                first, second = random.sample(candidates, 2)
+                return first if self._load(first) <= self._load(second) else second
+            lowest = min(self._load(r) for r in candidates)
+            return random.choice([r for r in candidates if self._load(r) == lowest])
+
+    def begin(self, replica):
+        """Mark a call as outstanding on a replica"""
+        with self._lock:
+            replica.in_flight += 1
+            replica.requests += 1
+
+    def end(self, replica, latency, success):
+        """Record the outcome of a call on a replica"""
+        with self._lock:
+            replica.in_flight -= 1
+            if not success:
+                replica.errors += 1
+            replica.latencies.append(latency)
+            if replica.ewma_latency:
+                replica.ewma_latency += EWMA_ALPHA * (latency - replica.ewma_latency)
+            else:
+                replica.ewma_latency = latency
+
+    def latency_percentile(self, pct):
+        """Percentile of recent call latencies across all replicas"""
+        with self._lock:
+            samples = [latency for r in self.replicas for latency in r.latencies]
+        return percentile(samples, pct)
+
+    def check_health(self):
+        """Probe every replica's health endpoint, ejecting or readmitting it"""
+        for replica in self.replicas:
+            try:
+                response = self._probe_session.get(f"{replica.url}/{HEALTH_CHECK_PATH}", timeout=HEALTH_CHECK_TIMEOUT)
+                response.close()
+                ok = response.status_code < 500
+            except Exception:
+                ok = False
+            with self._lock:
+                if ok:
+                    replica.consecutive_failures = 0
+                    replica.healthy = True
+                else:
+                    replica.consecutive_failures += 1
+                    if replica.consecutive_failures >= HEALTH_CHECK_FAILURES:
+                        replica.healthy = False
+
+    def get_stats(self):
+        """Get per-replica statistics"""
+        with self._lock:
+            return {
+                "strategy": self.strategy,
+                "replicas": [
+                    {
+                        "url": r.url,
+                        "healthy": r.healthy,
+                        "in_flight": r.in_flight,
+                        "requests": r.requests,
+                        "errors": r.errors,
+                        "ewma_latency_ms": round(r.ewma_latency * 1000, 2),
+                        "p50_latency_ms": round(percentile(r.latencies, 50) * 1000, 2),
+                        "p99_latency_ms": round(percentile(r.latencies, 99) * 1000, 2)
+                    }
+                    for r in self.replicas
+                ]
+            }
+
+
+def start_health_checker(replica_sets, interval=HEALTH_CHECK_INTERVAL):
+    """Start a daemon thread that health checks every replica periodically"""
+    def check():
+        while True:
+            for replica_set in replica_sets:
+                replica_set.check_health()
+            time.sleep(interval)
+
+    thread = threading.Thread(target=check, name='replica-health-checker', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,195 @@
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # Only needed for RATE_LIMIT_BACKEND=redis
+    redis = None
+
+# Rate limiting configuration from environment variables
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+# Requests allowed per period for each path prefix, e.g. '/api/generate=10/60'
+RATE_LIMITS = os.environ.get('RATE_LIMITS', '/api/generate=10/60,/api/images/generate/batch=2/60,/api/auth/login=5/60,/api/users/login=5/60')
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'local')  # 'local' or 'redis'
+RATE_LIMIT_REDIS_URL = os.environ.get('RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0')
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '100000'))
+
+
+class RateLimitRule:
+    """A token bucket of `capacity` requests refilled evenly over `period` seconds"""
+
+    def __init__(self, prefix, capacity, period):
+        self.prefix = prefix
+        self.capacity = capacity
+        self.period = period
+        self.rate = capacity / period
+
+    def __repr__(self):
+        return f"{self.prefix}={self.capacity}/{self.period:g}"
+
+
+def parse_rules(value):
+    """Parse 'prefix=capacity/period,...' into rules sorted by longest prefix first"""
+    rules = []
+    for item in value.split(','):
+        if '=' not in item:
+            continue
+        prefix, limit = item.rsplit('=', 1)
+        capacity, _, period = limit.partition('/')
+        rules.append(RateLimitRule(prefix.strip(), int(capacity), float(period or 1)))
+    return sorted(rules, key=lambda rule: len(rule.prefix), reverse=True)
+
+
+class LocalBackend:
+    """
+    Token buckets kept in this process, as (tokens, last update, refilled at) per key.
+    Buckets idle long enough to have refilled completely carry no information
+    and are evicted, and the number of keys is bounded.
+    """
+
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # least recently updated first
+        self._calls = 0
+        self.evictions = 0
+
+    def take(self, key, capacity, rate, cost=1):
+        """Take cost tokens from a bucket, return (allowed, tokens left)"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (capacity, now, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+            self._buckets.move_to_end(key)
+
+            self._calls += 1
+            if self._calls % 1000 == 0:
+                self._evict_idle(now)
+            # Over the bound, drop the least recently updated buckets
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+            return allowed, tokens
+
+    def _evict_idle(self, now):
+        # A bucket that has refilled completely is the same as a missing one
+        for key in [key for key, (_, _, refilled_at) in self._buckets.items() if refilled_at <= now]:
+            del self._buckets[key]
+            self.evictions += 1
+
+    def get_stats(self):
+        with self._lock:
+            return {"backend": "local", "keys": len(self._buckets), "evictions": self.evictions}
+
+
+# Refill and take atomically, using the Redis clock so every gateway process agrees on time
+TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - updated) * rate)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisBackend:
+    """
+    Token buckets shared by every gateway process through Redis.
+    Keys expire once their bucket would have refilled, so idle clients cost nothing.
+    """
+
+    def __init__(self, url=RATE_LIMIT_REDIS_URL, key_prefix='ratelimit:'):
+        if redis is None:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the redis package")
+        self.client = redis.Redis.from_url(url)
+        self.key_prefix = key_prefix
+        self._take = self.client.register_script(TAKE_SCRIPT)
+
+    def take(self, key, capacity, rate, cost=1):
+        """Take cost tokens from a bucket, return (allowed, tokens left)"""
+        allowed, tokens = self._take(keys=[self.key_prefix + key], args=[capacity, rate, cost])
+        return bool(allowed), float(tokens)
+
+    def get_stats(self):
+        return {"backend": "redis"}
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a client has used up its bucket for a route"""
+
+    def __init__(self, rule, retry_after):
+        super().__init__(f"Rate limit {rule} exceeded")
+        self.rule = rule
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """Per-route token buckets keyed by client (user ID or IP address)"""
+
+    def __init__(self, rules=None, backend=None):
+        self.rules = parse_rules(RATE_LIMITS) if rules is None else rules
+        self.backend = backend if backend is not None else (
+            RedisBackend() if RATE_LIMIT_BACKEND == 'redis' else LocalBackend())
+        self._lock = threading.Lock()
+        self._allowed = {}
+        self._limited = {}
+        self._backend_errors = 0
+
+    def rule_for(self, path):
+        for rule in self.rules:
+            if path.startswith(rule.prefix):
+                return rule
+        return None
+
+    def check(self, path, client_key):
+        """
+        Count a request against its route's bucket.
+        Returns (rule, tokens left) or (None, None) for unlimited routes,
+        and raises RateLimitExceeded when the bucket is empty.
+        """
+        rule = self.rule_for(path)
+        if rule is None:
+            return None, None
+        try:
+            allowed, tokens = self.backend.take(f"{rule.prefix}|{client_key}", rule.capacity, rule.rate)
+        except Exception:
+            # Fail open, an unreachable shared backend must not take the gateway down
+            with self._lock:
+                self._backend_errors += 1
+            return None, None
+        counts = self._allowed if allowed else self._limited
+        with self._lock:
+            counts[rule.prefix] = counts.get(rule.prefix, 0) + 1
+        if not allowed:
+            raise RateLimitExceeded(rule, max(1, math.ceil((1 - tokens) / rule.rate)))
+        return rule, tokens
+
+    def get_stats(self):
+        """Get rate limiting statistics"""
+        with self._lock:
+            return {
+                "rules": [repr(rule) for rule in self.rules],
+                "allowed": dict(self._allowed),
+                "limited": dict(self._limited),
+                "backend_errors": self._backend_errors,
+                **self.backend.get_stats()
+            }
@@ -0,0 +1,144 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Cache configuration from environment variables
+RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+# Comma separated "path-prefix=seconds" pairs, the longest matching prefix wins
+RESPONSE_CACHE_TTLS = os.environ.get(
+    'RESPONSE_CACHE_TTLS',
+    '/api/images/status=5,/api/images/health=10,/api/users/health=10'
+)
+
+# Rough per-entry bookkeeping overhead counted against the memory bound
+ENTRY_OVERHEAD_BYTES = 256
+
+
+def parse_route_ttls(spec):
+    """Parse "prefix=seconds,..." into a list of (prefix, ttl) sorted longest first"""
+    ttls = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item or '=' not in item:
+            continue
+        prefix, ttl = item.rsplit('=', 1)
+        ttls.append((prefix.strip(), float(ttl)))
+    return sorted(ttls, key=lambda pair: len(pair[0]), reverse=True)
+
+
+class CacheEntry:
+    """A cached upstream response"""
+
+    def __init__(self, status, headers, body, etag, ttl):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.etag = etag
+        self.ttl = ttl
+        self.expires_at = time.monotonic() + ttl
+        self.size = len(body) + sum(len(k) + len(v) for k, v in headers) + ENTRY_OVERHEAD_BYTES
+
+    def is_fresh(self):
+        return time.monotonic() < self.expires_at
+
+    def refresh(self):
+        """Extend the entry lifetime after a successful revalidation"""
+        self.expires_at = time.monotonic() + self.ttl
+
+
+class ResponseCache:
+    """
+    Memory-bounded LRU cache of idempotent GET responses.
+    Entries live for a per-route TTL, after which they are revalidated
+    upstream with If-None-Match instead of being fetched again.
+    """
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_MAX_BYTES, route_ttls=RESPONSE_CACHE_TTLS,
+                 enabled=RESPONSE_CACHE_ENABLED):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_bytes // 8
+        self.route_ttls = parse_route_ttls(route_ttls)
+        self.enabled = enabled
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "revalidated": 0,
+            "not_modified": 0,
+            "stores": 0,
+            "evictions": 0
+        }
+
+    def ttl_for(self, path):
+        """Return the TTL for a request path, 0 if the route is not cacheable"""
+        if not self.enabled:
+            return 0
+        for prefix, ttl in self.route_ttls:
+            if path.startswith(prefix):
+                return ttl
+        return 0
+
+    @staticmethod
+    def make_key(method, path, query_string, authorization):
+        """Build a cache key that varies on the Authorization header"""
+        auth_hash = hashlib.sha256((authorization or '').encode()).hexdigest()
+        return f"{method} {path}?{query_string} {auth_hash}"
+
+    @staticmethod
+    def compute_etag(body):
+        """Weak ETag for upstream responses that do not send one"""
+        return f'W/"{hashlib.sha1(body).hexdigest()}"'
+
+    def get(self, key):
+        """Return the entry for a key (fresh or stale) and mark it recently used"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        """Store an entry, evicting least recently used entries past the memory bound"""
+        if entry.size > self.max_entry_bytes:
+            return False
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+            self._stats["stores"] += 1
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self._stats["evictions"] += 1
+        return True
+
+    def record(self, event):
+        """Increment a hit/miss/revalidation counter"""
+        with self._lock:
+            self._stats[event] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self):
+        """Get cache statistics"""
+        with self._lock:
+            stats = dict(self._stats)
+            lookups = stats["hits"] + stats["misses"] + stats["revalidated"]
+            stats.update({
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hit_ratio": round((stats["hits"] + stats["revalidated"]) / lookups, 4) if lookups else 0.0
+            })
+            return stats
@@ -0,0 +1,55 @@
+import os
+
+# Size of the chunks forwarded in streaming mode
+PROXY_CHUNK_SIZE = int(os.environ.get('PROXY_CHUNK_SIZE', '65536'))
+
+
+class RequestBodyStream:
+    """
+    File-like view over an incoming request body of known length.
+    requests reads it in blocks and sends it with a Content-Length header,
+    so the body is never loaded into gateway memory as a whole.
+    """
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+
+def iter_request_body(stream, chunk_size=PROXY_CHUNK_SIZE):
+    """Yield a request body of unknown length, sent upstream with chunked encoding"""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def streaming_request_body(flask_request, chunk_size=PROXY_CHUNK_SIZE):
+    """Build a streaming upstream body for the incoming Flask request"""
+    length = flask_request.content_length
+    if length is not None:
+        return RequestBodyStream(flask_request.stream, length) if length else None
+    if flask_request.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+        return iter_request_body(flask_request.stream, chunk_size)
+    return None
+
+
+def iter_upstream_response(response, chunk_size=PROXY_CHUNK_SIZE, decode_content=True):
+    """Yield upstream response chunks as they arrive, then release the connection"""
+    try:
+        # Without decoding, a compressed upstream body is forwarded byte for byte
+        chunks = response.iter_content(chunk_size=chunk_size) if decode_content \
+            else response.raw.stream(chunk_size, decode_content=False)
+        for chunk in chunks:
+            if chunk:
+                yield chunk
+    finally:
+        # Runs on completion and when the client disconnects mid-stream
+        response.close()
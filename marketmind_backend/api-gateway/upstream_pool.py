@@ -0,0 +1,161 @@
+import os
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+import requests
+from requests.adapters import HTTPAdapter
+
+# Pool configuration from environment variables
+UPSTREAM_POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', '20'))
+UPSTREAM_POOL_BLOCK = os.environ.get('UPSTREAM_POOL_BLOCK', 'false').lower() == 'true'
+UPSTREAM_POOL_IDLE_TIMEOUT = float(os.environ.get('UPSTREAM_POOL_IDLE_TIMEOUT', '60'))
+
+# Explicit upstream timeouts, in seconds
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', '2'))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get('UPSTREAM_READ_TIMEOUT', '30'))
+
+
+class UpstreamPool:
+    """
+    Pool of persistent keep-alive connections to a single upstream service.
+    Wraps a requests.Session so connections are reused across proxied calls
+    instead of opening a new TCP connection per request.
+    """
+
+    def __init__(self, name, base_url, pool_size=UPSTREAM_POOL_SIZE,
+                 idle_timeout=UPSTREAM_POOL_IDLE_TIMEOUT, block=UPSTREAM_POOL_BLOCK):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.block = block
+
+        self._lock = threading.Lock()
+        self._session = None
+        self._last_used = time.monotonic()
+        self._in_flight = 0
+        self._requests = 0
+        self._errors = 0
+        self._sessions_created = 0
+        self._idle_evictions = 0
+
+    def _new_session(self):
+        """Create a session with a sized connection pool"""
+        session = requests.Session()
+        # Internal hops never go through an HTTP proxy, skip the per-request env lookup
+        session.trust_env = False
+        # The session is shared by all clients, so it must never keep upstream cookies
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            pool_block=self.block,
+            max_retries=0
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        self._sessions_created += 1
+        return session
+
+    def _get_session(self):
+        """Return the live session, replacing it if it sat idle for too long"""
+        with self._lock:
+            now = time.monotonic()
+            if self._session is not None and self._in_flight == 0 \
+                    and now - self._last_used > self.idle_timeout:
+                self._session.close()
+                self._session = None
+                self._idle_evictions += 1
+            if self._session is None:
+                self._session = self._new_session()
+            self._last_used = now
+            self._in_flight += 1
+            self._requests += 1
+            return self._session
+
+    def request(self, method, path, **kwargs):
+        """Send a request to the upstream over a pooled connection"""
+        session = self._get_session()
+        try:
+            return session.request(method=method, url=f"{self.base_url}/{path}", **kwargs)
+        except Exception:
+            with self._lock:
+                self._errors += 1
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._last_used = time.monotonic()
+
+    def evict_idle(self):
+        """Close pooled connections if the upstream has not been used recently"""
+        with self._lock:
+            if self._session is None or self._in_flight > 0:
+                return False
+            if time.monotonic() - self._last_used <= self.idle_timeout:
+                return False
+            self._session.close()
+            self._session = None
+            self._idle_evictions += 1
+            return True
+
+    def close(self):
+        """Close all pooled connections"""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def _connection_counts(self):
+        """Count connections opened and currently idle in the urllib3 pools"""
+        opened = 0
+        idle = 0
+        if self._session is None:
+            return opened, idle
+        # http:// and https:// share one adapter
+        adapters = {id(adapter): adapter for adapter in self._session.adapters.values()}
+        for adapter in adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                opened += pool.num_connections
+                if pool.pool is not None:
+                    # Free slots are filled with None placeholders
+                    idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        return opened, idle
+
+    def get_stats(self):
+        """Get pool statistics"""
+        with self._lock:
+            opened, idle = self._connection_counts()
+            return {
+                "base_url": self.base_url,
+                "pool_size": self.pool_size,
+                "idle_timeout": self.idle_timeout,
+                "requests": self._requests,
+                "errors": self._errors,
+                "in_flight": self._in_flight,
+                "connections_opened": opened,
+                "idle_connections": idle,
+                "sessions_created": self._sessions_created,
+                "idle_evictions": self._idle_evictions,
+                "idle_seconds": round(time.monotonic() - self._last_used, 3)
+            }
+
+
+def start_idle_reaper(pools, interval=None):
+    """Start a daemon thread that periodically evicts idle pools"""
+    if interval is None:
+        interval = max(1.0, min(pool.idle_timeout for pool in pools) / 2)
+
+    def reap():
+        while True:
+            time.sleep(interval)
+            for pool in pools:
+                pool.evict_idle()
+
+    thread = threading.Thread(target=reap, name='upstream-pool-reaper', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,44 @@
+"""
+Run one service for benchmarking.
+
+    python launch_service.py user-service 18001 --mock-mongo
+
+With --mock-mongo the user service talks to an in-memory mongomock database
+instead of a running mongod.
+"""
+import os
+import sys
+import logging
+import argparse
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run one service for benchmarking")
+    parser.add_argument('service', choices=['api-gateway', 'user-service', 'image-service'])
+    parser.add_argument('port', type=int)
+    parser.add_argument('--mock-mongo', action='store_true', help="Use mongomock instead of MONGO_URI")
+    args = parser.parse_args()
+
+    if args.mock_mongo:
+        import mongomock
+        import pymongo
+        # database.py imports MongoClient from pymongo, so patch before the service is imported
+        pymongo.MongoClient = mongomock.MongoClient
+
+    service_dir = os.path.join(BACKEND_DIR, args.service)
+    sys.path.insert(0, service_dir)
+    os.chdir(service_dir)
+
+    from werkzeug.serving import WSGIRequestHandler, run_simple
+    import app as service
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    # Same keep-alive behaviour as the services' own __main__
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"
+    run_simple('127.0.0.1', args.port, service.app, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
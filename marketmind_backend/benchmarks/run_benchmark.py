@@ -0,0 +1,306 @@
+"""
+End-to-end load test of the api-gateway -> user-service / image-service chain.
+
+Starts the three services on local ports (the user service on mongomock unless
+--mongo-uri is given, the image service with its mock ImageGenerator), drives a
+weighted mix of routes at a fixed request rate through the gateway, and writes
+throughput, latency percentiles and errors per route to a JSON file.
+
+    python run_benchmark.py --rps 50 --duration 30
+    python run_benchmark.py --rps 50 --duration 30 --baseline results/previous.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import subprocess
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARK_DIR)
+
+sys.path.append(BACKEND_DIR)
+from common.stats import percentile
+
+BENCHMARK_USER = {"email": "benchmark@example.com", "password": "benchmark-password", "name": "Benchmark"}
+BENCHMARK_JWT_SECRET = 'benchmark_jwt_secret_key_for_load_tests'
+
+# Route name -> (method, gateway path, request body, needs a token)
+ROUTES = {
+    'health': ('GET', '/health', None, False),
+    'image_status': ('GET', '/api/images/status', None, True),
+    'user_me': ('GET', '/api/users/me', None, True),
+    'login': ('POST', '/api/users/login', BENCHMARK_USER, False),
+    'generate': ('POST', '/api/generate', 'prompt', True),
+}
+DEFAULT_MIX = 'health=1,image_status=3,user_me=2,login=1,generate=2'
+PROMPTS = [f"benchmark prompt number {i}" for i in range(16)]
+
+
+def parse_mix(value):
+    """Parse 'route=weight,...' into {route: weight}"""
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in ROUTES:
+            raise ValueError(f"Unknown route '{name}', expected one of {', '.join(ROUTES)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Stack:
+    """The three services running as local subprocesses"""
+
+    def __init__(self, base_port, mongo_uri=None, gateway_env=None):
+        self.gateway_url = f"http://127.0.0.1:{base_port}"
+        self.user_url = f"http://127.0.0.1:{base_port + 1}"
+        self.image_url = f"http://127.0.0.1:{base_port + 2}"
+        self.base_port = base_port
+        self.mongo_uri = mongo_uri
+        self.gateway_env = gateway_env or {}
+        self.processes = []
+
+    def _launch(self, service, port, env, mock_mongo=False):
+        command = [sys.executable, os.path.join(BENCHMARK_DIR, 'launch_service.py'), service, str(port)]
+        if mock_mongo:
+            command.append('--mock-mongo')
+        self.processes.append(subprocess.Popen(
+            command, env=dict(os.environ, **env), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+
+    def start(self, timeout=30):
+        shared = {'JWT_SECRET': BENCHMARK_JWT_SECRET, 'INTERNAL_AUTH_SECRET': BENCHMARK_JWT_SECRET}
+        user_env = dict(shared, MONGO_URI=self.mongo_uri or 'mongodb://localhost:27017/benchmark_db')
+        self._launch('user-service', self.base_port + 1, user_env, mock_mongo=self.mongo_uri is None)
+        self._launch('image-service', self.base_port + 2, shared)
+        self._launch('api-gateway', self.base_port, dict(
+            shared, USER_SERVICE_URL=self.user_url, IMAGE_SERVICE_URL=self.image_url, **self.gateway_env))
+        for url in (self.user_url, self.image_url, self.gateway_url):
+            wait_until_healthy(url, timeout)
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def wait_until_healthy(url, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{url}/health", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become healthy within {timeout}s")
+
+
+def get_token(gateway_url):
+    """Create the benchmark user if needed and log in"""
+    requests.post(f"{gateway_url}/api/users/signup", json=BENCHMARK_USER, timeout=10)
+    response = requests.post(f"{gateway_url}/api/users/login", json=BENCHMARK_USER, timeout=10)
+    response.raise_for_status()
+    return response.json()['token']
+
+
+class LoadDriver:
+    """
+    Open-loop load at a fixed request rate.
+    Requests are sent on schedule whether or not earlier ones have returned, and
+    latency is measured from the scheduled send time so a stalled server is not
+    hidden by the client slowing down.
+    """
+
+    def __init__(self, gateway_url, token, mix, rps, duration, workers, timeout):
+        self.gateway_url = gateway_url
+        self.token = token
+        self.mix = mix
+        self.rps = rps
+        self.duration = duration
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='load')
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _send(self, name, scheduled):
+        method, path, body, needs_token = ROUTES[name]
+        headers = {'Authorization': f"Bearer {self.token}"} if needs_token else {}
+        if body == 'prompt':
+            body = {"prompt": random.choice(PROMPTS), "width": 256, "height": 256}
+        try:
+            response = self._session().request(method, self.gateway_url + path, json=body, headers=headers,
+                                               timeout=self.timeout)
+            status = response.status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        return name, time.perf_counter() - scheduled, status
+
+    def run(self):
+        names = list(self.mix)
+        weights = [self.mix[name] for name in names]
+        total = int(self.rps * self.duration)
+        start = time.perf_counter()
+        futures = []
+        for i in range(total):
+            scheduled = start + i / self.rps
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(self.executor.submit(self._send, random.choices(names, weights)[0], scheduled))
+        results = [future.result() for future in futures]
+        elapsed = time.perf_counter() - start
+        self.executor.shutdown()
+        return results, elapsed
+
+
+def summarize(results, elapsed):
+    """Throughput, latency percentiles and errors, overall and per route"""
+    by_route = {}
+    for name, latency, status in results:
+        by_route.setdefault(name, []).append((latency, status))
+
+    def stats(samples):
+        latencies = sorted(latency * 1000.0 for latency, _ in samples)
+        statuses = {}
+        for _, status in samples:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        errors = sum(count for status, count in statuses.items() if not status.isdigit() or int(status) >= 400)
+        return {
+            "requests": len(samples),
+            "errors": errors,
+            "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+            "throughput_rps": round((len(samples) - errors) / elapsed, 2),
+            "latency_ms": {
+                "p50": round(percentile(latencies, 50), 2),
+                "p95": round(percentile(latencies, 95), 2),
+                "p99": round(percentile(latencies, 99), 2),
+                "max": round(latencies[-1], 2),
+                "mean": round(sum(latencies) / len(latencies), 2)
+            },
+            "statuses": statuses
+        }
+
+    return {
+        "elapsed_seconds": round(elapsed, 2),
+        "overall": stats([(latency, status) for _, latency, status in results]),
+        "routes": {name: stats(samples) for name, samples in sorted(by_route.items())}
+    }
+
+
+def compare(report, baseline):
+    """Print per-route throughput and tail latency changes against an earlier report"""
+    print(f"\nAgainst baseline {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    for name in ['overall'] + list(report['routes']):
+        current = report['overall'] if name == 'overall' else report['routes'][name]
+        previous = baseline['overall'] if name == 'overall' else baseline.get('routes', {}).get(name)
+        if previous is None:
+            continue
+        changes = []
+        for key in ('p50', 'p95', 'p99'):
+            before, after = previous['latency_ms'][key], current['latency_ms'][key]
+            changes.append(f"{key} {before:.1f} -> {after:.1f} ms ({(after - before) / before * 100 if before else 0:+.0f}%)")
+        changes.append(f"rps {previous['throughput_rps']} -> {current['throughput_rps']}")
+        changes.append(f"errors {previous['errors']} -> {current['errors']}")
+        print(f"  {name:<14} " + ', '.join(changes))
+
+
+def print_report(report):
+    print(f"{'route':<14} {'reqs':>6} {'errors':>6} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, stats in list(report['routes'].items()) + [('overall', report['overall'])]:
+        latency = stats['latency_ms']
+        print(f"{name:<14} {stats['requests']:>6} {stats['errors']:>6} {stats['throughput_rps']:>8} "
+              f"{latency['p50']:>9} {latency['p95']:>9} {latency['p99']:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the gateway and services")
+    parser.add_argument('--rps', type=float, default=50, help="Target request rate")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds of load")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"Route weights (default {DEFAULT_MIX})")
+    parser.add_argument('--workers', type=int, default=256, help="Client threads")
+    parser.add_argument('--timeout', type=float, default=30, help="Client timeout per request")
+    parser.add_argument('--warmup', type=float, default=3, help="Seconds of load before measuring")
+    parser.add_argument('--base-port', type=int, default=18000, help="Gateway port, services use the next two")
+    parser.add_argument('--mongo-uri', help="Use a running mongod instead of mongomock")
+    parser.add_argument('--gateway-url', help="Benchmark an already running gateway instead of starting one")
+    parser.add_argument('--rate-limit', action='store_true', help="Keep the gateway rate limiter enabled")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="Result file (default results/<timestamp>-<commit>.json)")
+    parser.add_argument('--baseline', help="Earlier result file to compare against")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    mix = parse_mix(args.mix)
+
+    stack = None
+    gateway_url = args.gateway_url
+    if gateway_url is None:
+        gateway_env = {} if args.rate_limit else {'RATE_LIMIT_ENABLED': 'false'}
+        stack = Stack(args.base_port, args.mongo_uri, gateway_env)
+        stack.start()
+        gateway_url = stack.gateway_url
+
+    try:
+        token = get_token(gateway_url)
+        if args.warmup:
+            LoadDriver(gateway_url, token, mix, args.rps, args.warmup, args.workers, args.timeout).run()
+        results, elapsed = LoadDriver(
+            gateway_url, token, mix, args.rps, args.duration, args.workers, args.timeout).run()
+    finally:
+        if stack is not None:
+            stack.stop()
+
+    commit = git_commit()
+    timestamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    report = {
+        "commit": commit,
+        "timestamp": timestamp,
+        "config": {
+            "target_rps": args.rps,
+            "duration_seconds": args.duration,
+            "mix": mix,
+            "workers": args.workers,
+            "mongo": args.mongo_uri or "mongomock",
+            "rate_limit": args.rate_limit,
+            "gateway_url": args.gateway_url
+        },
+        **summarize(results, elapsed)
+    }
+
+    output = args.output or os.path.join(BENCHMARK_DIR, 'results', f"{timestamp}-{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print_report(report)
+    print(f"\nResults written to {output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
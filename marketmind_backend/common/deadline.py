@@ -0,0 +1,85 @@
+import time
+from flask import g, jsonify, request
+
+# Absolute deadline of a request, in milliseconds since the epoch
+DEADLINE_HEADER = 'X-Request-Deadline'
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's deadline passes before its work is done"""
+
+    def __init__(self, stage=None):
+        super().__init__(f"Deadline exceeded{' before ' + stage if stage else ''}")
+        self.stage = stage
+
+
+def parse_deadline(value):
+    """Parse a deadline header value into epoch seconds, or None if missing or invalid"""
+    try:
+        return int(value) / 1000.0 if value else None
+    except ValueError:
+        return None
+
+
+def format_deadline(deadline):
+    """Format epoch seconds as a deadline header value"""
+    return str(int(deadline * 1000))
+
+
+def parse_route_budgets(value):
+    """Parse 'prefix=seconds,prefix=seconds' into a list sorted by longest prefix first"""
+    budgets = []
+    for item in value.split(','):
+        if '=' not in item:
+            continue
+        prefix, seconds = item.rsplit('=', 1)
+        budgets.append((prefix.strip(), float(seconds)))
+    return sorted(budgets, key=lambda budget: len(budget[0]), reverse=True)
+
+
+def budget_for(budgets, path, default=None):
+    """Seconds allowed for a path, from the longest matching prefix"""
+    for prefix, seconds in budgets:
+        if path.startswith(prefix):
+            return seconds
+    return default
+
+
+def remaining(deadline):
+    """Seconds left before the deadline, or None when there is no deadline"""
+    return None if deadline is None else deadline - time.time()
+
+
+def check_deadline(deadline, stage=None):
+    """Raise DeadlineExceeded if the deadline has already passed"""
+    if deadline is not None and time.time() >= deadline:
+        raise DeadlineExceeded(stage)
+
+
+def current_deadline():
+    """Deadline of the request being handled, or None"""
+    return g.get('deadline')
+
+
+def init_app(app, on_expired=None):
+    """
+    Honor the deadline header on every request of a Flask app.
+    Requests that were queued past their deadline are answered 504 without running
+    the view, and DeadlineExceeded raised mid-flight is turned into a 504.
+    """
+
+    @app.before_request
+    def skip_expired():
+        g.deadline = parse_deadline(request.headers.get(DEADLINE_HEADER))
+        if g.deadline is not None and time.time() >= g.deadline:
+            if on_expired is not None:
+                on_expired('queued')
+            return jsonify({"error": "Deadline exceeded"}), 504
+
+    @app.errorhandler(DeadlineExceeded)
+    def deadline_exceeded(e):
+        if on_expired is not None:
+            on_expired(e.stage or 'in_flight')
+        return jsonify({"error": str(e)}), 504
+
+    return app
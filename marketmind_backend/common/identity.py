@@ -0,0 +1,47 @@
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+
+# Identity asserted by the gateway after it verified the caller's JWT
+IDENTITY_HEADER = 'X-Authenticated-Identity'
+
+# Shared by the gateway and the services, never exposed to clients.
+# Without it no identity is signed or trusted and services verify the bearer token themselves.
+INTERNAL_AUTH_SECRET = os.environ.get('INTERNAL_AUTH_SECRET', '')
+
+# Seconds a signed identity stays valid, so a captured header cannot be replayed for long
+IDENTITY_MAX_AGE = float(os.environ.get('IDENTITY_MAX_AGE', '30'))
+
+
+def _signature(payload, secret):
+    return hmac.new(secret.encode(), payload.encode(), hashlib.sha256).hexdigest()
+
+
+def sign_identity(claims, secret=INTERNAL_AUTH_SECRET):
+    """Encode verified claims as a signed identity header value, or None without a secret"""
+    if not secret:
+        return None
+    data = dict(claims, _signed_at=time.time())
+    payload = base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode()
+    return f"{payload}.{_signature(payload, secret)}"
+
+
+def verify_identity(value, secret=INTERNAL_AUTH_SECRET, max_age=IDENTITY_MAX_AGE):
+    """Return the claims of a signed identity header value, or None if missing, forged or stale"""
+    if not secret or not value or '.' not in value:
+        return None
+    payload, signature = value.rsplit('.', 1)
+    if not hmac.compare_digest(signature, _signature(payload, secret)):
+        return None
+    try:
+        claims = json.loads(base64.urlsafe_b64decode(payload.encode()))
+    except ValueError:
+        return None
+    if time.time() - claims.pop('_signed_at', 0) > max_age:
+        return None
+    if 'exp' in claims and time.time() >= claims['exp']:
+        return None
+    return claims
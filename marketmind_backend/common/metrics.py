@@ -0,0 +1,217 @@
+import time
+import threading
+from flask import Response, g, request
+
+# Latency buckets in seconds, from fast health checks to slow image generation
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """Cumulative bucket histogram"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other):
+        """Add the observations of a histogram with the same buckets"""
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.sum += other.sum
+
+    def copy(self):
+        histogram = Histogram(self.buckets)
+        histogram.merge(self)
+        return histogram
+
+    def to_dict(self):
+        return {
+            "buckets": {str(bound): count for bound, count in zip(self.buckets, self.counts)},
+            "count": self.count,
+            "sum": round(self.sum, 6)
+        }
+
+
+class MetricFamily:
+    """A named metric with one child value per label combination"""
+
+    def __init__(self, name, metric_type, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.type = metric_type
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            histogram = self._values.get(key)
+            if histogram is None:
+                histogram = self._values[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def samples(self):
+        """Return (labels dict, value) pairs"""
+        with self._lock:
+            return [(dict(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_family(name, metric_type, help_text, samples):
+    """Render one metric family in the Prometheus text exposition format"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        if metric_type == 'histogram':
+            for bound, count in zip(value.buckets, value.counts):
+                bucket_labels = dict(labels, le=_format_value(float(bound)))
+                lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {count}")
+            lines.append(f"{name}_bucket{_format_labels(dict(labels, le='+Inf'))} {value.count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value.sum)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {value.count}")
+        else:
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return lines
+
+
+class Metrics:
+    """
+    Per-service metrics registry.
+    Records request count, errors, in-flight requests and latency histograms
+    per route, and serves everything at /metrics in Prometheus text format.
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self._families = []
+        self._collectors = []
+
+        self.requests = self.counter(
+            'http_requests_total', 'HTTP requests handled', ('service', 'route', 'method', 'status'))
+        self.errors = self.counter(
+            'http_request_errors_total', 'HTTP requests that failed with a 5xx or an exception',
+            ('service', 'route', 'method'))
+        self.in_flight = self.gauge(
+            'http_requests_in_flight', 'HTTP requests currently being handled', ('service', 'route'))
+        self.latency = self.histogram(
+            'http_request_duration_seconds', 'Time to produce the HTTP response',
+            ('service', 'route', 'method'))
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(MetricFamily(name, 'counter', help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._register(MetricFamily(name, 'gauge', help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(MetricFamily(name, 'histogram', help_text, labelnames, buckets))
+
+    def _register(self, family):
+        self._families.append(family)
+        return family
+
+    def register_collector(self, collector):
+        """
+        Add a callable invoked on every scrape.
+        It returns a list of (name, type, help, samples) tuples where samples
+        are (labels dict, value) pairs, or (labels dict, Histogram) pairs.
+        """
+        self._collectors.append(collector)
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format"""
+        lines = []
+        for family in self._families:
+            lines.extend(render_family(family.name, family.type, family.help, family.samples()))
+        for collector in self._collectors:
+            for name, metric_type, help_text, samples in collector():
+                lines.extend(render_family(name, metric_type, help_text, samples))
+        return '\n'.join(lines) + '\n'
+
+    def init_app(self, app):
+        """Instrument every route of a Flask app and serve /metrics"""
+
+        def route_label():
+            return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+        @app.before_request
+        def start_timer():
+            g._metrics_start = time.perf_counter()
+            g._metrics_route = route_label()
+            self.in_flight.inc(service=self.service, route=g._metrics_route)
+
+        @app.after_request
+        def record_request(response):
+            if getattr(g, '_metrics_start', None) is None:
+                return response
+            route = g._metrics_route
+            self.latency.observe(time.perf_counter() - g._metrics_start,
+                                 service=self.service, route=route, method=request.method)
+            self.requests.inc(service=self.service, route=route, method=request.method,
+                              status=response.status_code)
+            if response.status_code >= 500:
+                self.errors.inc(service=self.service, route=route, method=request.method)
+            self.in_flight.dec(service=self.service, route=route)
+            g._metrics_start = None
+            return response
+
+        @app.teardown_request
+        def record_failure(exc):
+            # after_request did not run, the view raised
+            if getattr(g, '_metrics_start', None) is None:
+                return
+            route = g._metrics_route
+            self.errors.inc(service=self.service, route=route, method=request.method)
+            self.in_flight.dec(service=self.service, route=route)
+            g._metrics_start = None
+
+        @app.route('/metrics', methods=['GET'])
+        def metrics_endpoint():
+            return Response(self.render(), mimetype=None, content_type=CONTENT_TYPE)
+
+        return self
@@ -0,0 +1,10 @@
+import math
+
+
+def percentile(samples, pct, default=0.0):
+    """Nearest-rank percentile of a list of numbers, or default when there are none"""
+    if not samples:
+        return default
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[index]
@@ -0,0 +1,345 @@
+import os
+import json
+import time
+import random
+import threading
+import contextvars
+from contextlib import contextmanager
+from urllib import request as urllib_request
+
+# Tracing configuration from environment variables
+TRACE_EXPORTER = os.environ.get('TRACE_EXPORTER', 'none')  # 'none', 'file' or 'otlp'
+TRACE_FILE = os.environ.get('TRACE_FILE', 'traces.jsonl')
+TRACE_OTLP_ENDPOINT = os.environ.get('TRACE_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+# Share of new traces recorded; calls that arrive with a trace context follow the caller's decision
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '1.0'))
+TRACE_BATCH_SIZE = int(os.environ.get('TRACE_BATCH_SIZE', '512'))
+TRACE_FLUSH_INTERVAL = float(os.environ.get('TRACE_FLUSH_INTERVAL', '2'))
+TRACE_MAX_QUEUE = int(os.environ.get('TRACE_MAX_QUEUE', '10000'))
+
+# W3C trace context header
+TRACEPARENT_HEADER = 'traceparent'
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+def parse_traceparent(value):
+    """Return (trace_id, parent span_id, sampled) from a traceparent header, or None"""
+    parts = (value or '').strip().split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        flags = int(parts[3], 16)
+        int(parts[1], 16)
+        int(parts[2], 16)
+    except ValueError:
+        return None
+    if parts[1] == '0' * 32 or parts[2] == '0' * 16:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+
+class Span:
+    """A timed operation within a trace, only exported when its trace is sampled"""
+
+    def __init__(self, tracer, name, trace_id, parent_id, sampled, kind='internal', attributes=None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.status = 'ok'
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_error(self, error):
+        self.status = 'error'
+        self.error = f"{type(error).__name__}: {error}"
+
+    def end(self):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if self.sampled:
+            self.tracer.processor.submit(self)
+
+    def to_dict(self):
+        return {
+            "service": self.tracer.service,
+            "name": self.name,
+            "kind": self.kind,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes
+        }
+
+
+class FileExporter:
+    """Appends finished spans to a file, one JSON object per line"""
+
+    def __init__(self, path=TRACE_FILE):
+        self.path = path
+
+    def export(self, spans):
+        with open(self.path, 'a') as f:
+            for span in spans:
+                f.write(json.dumps(span.to_dict(), default=str) + '\n')
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OtlpExporter:
+    """Posts spans to an OTLP/HTTP collector using the JSON encoding"""
+
+    KINDS = {'internal': 1, 'server': 2, 'client': 3}
+
+    def __init__(self, service, endpoint=TRACE_OTLP_ENDPOINT, timeout=5):
+        self.service = service
+        self.endpoint = endpoint
+        self.timeout = timeout
+
+    def export(self, spans):
+        otlp_spans = []
+        for span in spans:
+            otlp_span = {
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": self.KINDS.get(span.kind, 1),
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns),
+                "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+                "status": {"code": 2, "message": span.error} if span.status == 'error' else {"code": 1}
+            }
+            if span.parent_id:
+                otlp_span["parentSpanId"] = span.parent_id
+            otlp_spans.append(otlp_span)
+        body = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service}}]},
+            "scopeSpans": [{"scope": {"name": "marketmind.tracing"}, "spans": otlp_spans}]
+        }]}
+        otlp_request = urllib_request.Request(
+            self.endpoint, data=json.dumps(body).encode(), headers={'Content-Type': 'application/json'})
+        urllib_request.urlopen(otlp_request, timeout=self.timeout).close()
+
+
+class BatchProcessor:
+    """
+    Exports finished spans in batches from a background thread.
+    Spans are dropped instead of blocking requests when the queue is full
+    or the exporter fails.
+    """
+
+    def __init__(self, exporter, batch_size=TRACE_BATCH_SIZE, interval=TRACE_FLUSH_INTERVAL,
+                 max_queue=TRACE_MAX_QUEUE):
+        self.exporter = exporter
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._queue = []
+        self._wakeup = threading.Event()
+        self.exported = 0
+        self.dropped = 0
+        if exporter is not None:
+            threading.Thread(target=self._run, name='trace-export', daemon=True).start()
+
+    def submit(self, span):
+        if self.exporter is None:
+            return
+        with self._lock:
+            if len(self._queue) >= self.max_queue:
+                self.dropped += 1
+                return
+            self._queue.append(span)
+            if len(self._queue) >= self.batch_size:
+                self._wakeup.set()
+
+    def flush(self):
+        with self._lock:
+            spans, self._queue = self._queue, []
+        if not spans:
+            return
+        try:
+            self.exporter.export(spans)
+            self.exported += len(spans)
+        except Exception as e:
+            self.dropped += len(spans)
+            print(f"Error exporting spans: {e}")
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+class Tracer:
+    """Creates spans for one service and propagates trace context to other services"""
+
+    def __init__(self, service, exporter=None, sample_rate=TRACE_SAMPLE_RATE):
+        self.service = service
+        self.sample_rate = sample_rate
+        self.processor = BatchProcessor(exporter)
+
+    def _sample(self, trace_id):
+        # Decided from the trace ID so every service would make the same call for a trace
+        return int(trace_id[16:], 16) < self.sample_rate * (1 << 64)
+
+    def start_span(self, name, parent=None, traceparent=None, kind='internal', attributes=None):
+        """Start a span under parent, the remote traceparent, or the current span"""
+        if parent is None and traceparent is None:
+            parent = _current_span.get()
+        if parent is not None:
+            return Span(self, name, parent.trace_id, parent.span_id, parent.sampled, kind, attributes)
+        remote = parse_traceparent(traceparent)
+        if remote is not None:
+            trace_id, parent_id, sampled = remote
+            return Span(self, name, trace_id, parent_id, sampled, kind, attributes)
+        trace_id = '%032x' % random.getrandbits(128)
+        return Span(self, name, trace_id, None, self._sample(trace_id), kind, attributes)
+
+    @contextmanager
+    def span(self, name, kind='internal', **attributes):
+        """Run a block in a child span of the current span"""
+        span = self.start_span(name, kind=kind, attributes=attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_error(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+    def get_stats(self):
+        return {
+            "exporter": type(self.processor.exporter).__name__ if self.processor.exporter else None,
+            "sample_rate": self.sample_rate,
+            "exported": self.processor.exported,
+            "dropped": self.processor.dropped
+        }
+
+
+# Process-wide tracer, replaced by init_tracer() when a service starts
+_tracer = Tracer('unknown')
+
+
+def init_tracer(service, exporter_name=TRACE_EXPORTER, sample_rate=TRACE_SAMPLE_RATE):
+    """Configure the process-wide tracer from the TRACE_* settings"""
+    global _tracer
+    exporter = None
+    if exporter_name == 'file':
+        exporter = FileExporter()
+    elif exporter_name == 'otlp':
+        exporter = OtlpExporter(service)
+    _tracer = Tracer(service, exporter, sample_rate if exporter is not None else 0.0)
+    return _tracer
+
+
+def get_tracer():
+    return _tracer
+
+
+def span(name, kind='internal', **attributes):
+    """Run a block in a child span of the current span, using the process-wide tracer"""
+    return _tracer.span(name, kind=kind, **attributes)
+
+
+def current_span():
+    return _current_span.get()
+
+
+def inject(headers):
+    """Add the current trace context to outgoing request headers"""
+    current = _current_span.get()
+    if current is not None:
+        headers[TRACEPARENT_HEADER] = current.traceparent
+    return headers
+
+
+class Stages:
+    """
+    Spans for the consecutive stages of one operation.
+    Entering a stage ends the previous one, all under a parent span for the operation.
+    """
+
+    def __init__(self, name, **attributes):
+        self.parent = _tracer.start_span(name, attributes=attributes)
+        self.current = None
+
+    def enter(self, name, **attributes):
+        if self.current is not None:
+            self.current.end()
+        self.current = _tracer.start_span(f"{self.parent.name}.{name}", parent=self.parent, attributes=attributes)
+        return self.current
+
+    def close(self, error=None):
+        """End the current stage and the operation, recording an error on both"""
+        for span in (self.current, self.parent):
+            if span is not None and span.end_ns is None:
+                if error is not None:
+                    span.record_error(error)
+                span.end()
+
+
+def init_app(app, tracer=None):
+    """Trace every request of a Flask app as a server span continuing the caller's trace"""
+    from flask import g, request
+
+    @app.before_request
+    def start_server_span():
+        active = tracer or _tracer
+        rule = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        server_span = active.start_span(
+            f"{request.method} {rule}", traceparent=request.headers.get(TRACEPARENT_HEADER), kind='server',
+            attributes={"http.method": request.method, "http.route": rule, "http.target": request.path})
+        g._trace_span = server_span
+        g._trace_token = _current_span.set(server_span)
+
+    @app.after_request
+    def record_status(response):
+        server_span = g.get('_trace_span')
+        if server_span is not None:
+            server_span.set_attribute("http.status_code", response.status_code)
+            if response.status_code >= 500:
+                server_span.status = 'error'
+        return response
+
+    @app.teardown_request
+    def end_server_span(exc):
+        server_span = g.pop('_trace_span', None)
+        if server_span is None:
+            return
+        if exc is not None:
+            server_span.record_error(exc)
+        _current_span.reset(g.pop('_trace_token'))
+        server_span.end()
+
+    return app
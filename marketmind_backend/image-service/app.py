@@ -1,9 +1,25 @@
 import os
+import sys
 import json
 import jwt
-from flask import Flask, request, jsonify
+import base64
+from urllib.parse import quote
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from image_generator import ImageGenerator
+from werkzeug.serving import WSGIRequestHandler
+
+# Shared modules live next to the service directories (copied to /app/common in Docker)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import deadline
+from common.identity import IDENTITY_HEADER, verify_identity
+from common.metrics import Metrics
+from common import tracing
+from image_generator import ENCODER_PRESET, OUTPUT_FORMATS, PRESETS, encoder_stats
+from models import READY, ModelUnavailable, registry as model_registry
+from rendering import render_backend, render_image, result_cache
+from single_flight import SingleFlight
+import batch
+import jobs
 
 app = Flask(__name__)
 # CORS(app)
@@ -14,6 +30,127 @@ CORS(app, resources={r"/*": {"origins": "http://localhost:3000"}}, supports_cred
 # JWT Configuration
 JWT_SECRET = os.environ.get('JWT_SECRET', 'your_jwt_secret_key_here')
 
+# Identical concurrent generation requests share one rendering
+generation_flight = SingleFlight()
+
+# Request count, errors, in-flight and latency per route, served at /metrics
+metrics = Metrics('image-service').init_app(app)
+
+def collect_coalescing():
+    stats = generation_flight.get_stats()
+    return [
+        ("image_generation_executions_total", "counter", "Renderings actually executed",
+         [({}, stats["executions"])]),
+        ("image_generation_coalesced_total", "counter", "Generation requests served by another request's rendering",
+         [({}, stats["coalesced"])]),
+        ("image_generation_coalesced_retries_total", "counter",
+         "Coalesced requests that rendered again after the shared rendering missed an earlier deadline",
+         [({}, stats["retried"])]),
+    ]
+
+metrics.register_collector(collect_coalescing)
+
+def collect_result_cache():
+    stats = result_cache.get_stats()
+    tiers = [(tier, stats[tier]) for tier in ("memory", "disk") if stats[tier] is not None]
+    return [
+        ("image_result_cache_lookups_total", "counter", "Result cache lookups by the tier that answered, or miss",
+         [({"result": result}, count) for result, count in stats["lookups"].items()]),
+        ("image_result_cache_bytes_served_total", "counter", "Bytes of images served from the result cache",
+         [({"tier": tier}, count) for tier, count in stats["bytes_served"].items()]),
+        ("image_result_cache_evictions_total", "counter", "Results evicted to stay within a tier's size bound",
+         [({"tier": tier}, tier_stats["evictions"]) for tier, tier_stats in tiers]),
+        ("image_result_cache_bytes", "gauge", "Bytes of results held per tier",
+         [({"tier": tier}, tier_stats["bytes"]) for tier, tier_stats in tiers]),
+        ("image_result_cache_entries", "gauge", "Results held per tier",
+         [({"tier": tier}, tier_stats["entries"]) for tier, tier_stats in tiers]),
+    ]
+
+metrics.register_collector(collect_result_cache)
+
+def collect_render_pool():
+    stats = render_backend.get_stats()
+    if stats["backend"] != "process":
+        return []
+    return [
+        ("image_render_pool_processes", "gauge", "Rendering worker processes", [({}, stats["processes"])]),
+        ("image_render_pool_in_flight", "gauge", "Renderings submitted to the worker pool and not yet returned",
+         [({}, stats["in_flight"])]),
+        ("image_render_pool_renders_total", "counter", "Renderings done by the worker pool by outcome",
+         [({"outcome": outcome}, count) for outcome, count in stats["outcomes"].items()]),
+        ("image_render_pool_bytes_total", "counter", "Bytes of encoded images returned through shared memory",
+         [({}, stats["bytes"])]),
+    ]
+
+metrics.register_collector(collect_render_pool)
+
+def collect_encoding():
+    encodes = [({"format": image_format.lower(), "preset": preset}, seconds, size)
+               for (image_format, preset), seconds, size in encoder_stats.snapshot()]
+    return [
+        ("image_encode_seconds", "histogram", "Time to encode a rendered image by format and preset",
+         [(labels, seconds) for labels, seconds, _ in encodes]),
+        ("image_encoded_bytes", "histogram", "Size of encoded images by format and preset",
+         [(labels, size) for labels, _, size in encodes]),
+    ]
+
+metrics.register_collector(collect_encoding)
+
+# Run as a script the debug reloader imports this module twice: in a watcher process that only
+# restarts the server on code changes, and in the serving process it starts with WERKZEUG_RUN_MAIN set
+RELOADER_WATCHER = __name__ == '__main__' and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
+
+# Model backends are loaded once, before any request or job can use them
+if not RELOADER_WATCHER:
+    model_registry.load_all()
+
+def collect_models():
+    stats = model_registry.get_stats()
+    return [
+        ("image_model_ready", "gauge", "Whether a model backend loaded and is serving",
+         [({"model": name}, int(state["status"] == READY)) for name, state in stats.items()]),
+        ("image_model_load_seconds", "gauge", "Time a model backend took to load",
+         [({"model": name}, state["load_seconds"]) for name, state in stats.items() if state["load_seconds"] is not None]),
+        ("image_model_memory_bytes", "gauge", "Bytes of weights held by a model backend",
+         [({"model": name}, state["memory_bytes"]) for name, state in stats.items()]),
+    ]
+
+metrics.register_collector(collect_models)
+
+# Asynchronous generation jobs, run by worker threads here or by standalone workers on a shared queue
+job_store = jobs.make_store()
+job_workers = jobs.JobWorkerPool(job_store)
+if not RELOADER_WATCHER:
+    job_workers.start()
+
+def collect_jobs():
+    stats = job_workers.get_stats()
+    return [
+        ("image_jobs_queued", "gauge", "Generation jobs waiting for a worker", [({}, stats["queued"])]),
+        ("image_jobs_running", "gauge", "Generation jobs running in this process", [({}, stats["running"])]),
+        ("image_jobs_finished_total", "counter", "Generation jobs finished in this process by outcome",
+         [({"outcome": outcome}, stats[outcome]) for outcome in (jobs.SUCCEEDED, jobs.FAILED)]),
+    ]
+
+metrics.register_collector(collect_jobs)
+
+# Server span per request, continuing the gateway's trace
+tracing.init_app(app, tracing.init_tracer('image-service'))
+
+# Work whose deadline passed is skipped while queued or abandoned between generation stages
+deadline_exceeded = metrics.counter(
+    'deadline_exceeded_total', 'Requests dropped because their deadline passed', ('service', 'stage'))
+deadline.init_app(app, on_expired=lambda stage: deadline_exceeded.inc(service='image-service', stage=stage))
+
+batch_items = metrics.counter(
+    'image_batch_items_total', 'Batch generation items by outcome', ('outcome',))
+batch_item_latency = metrics.histogram(
+    'image_batch_item_seconds', 'Time from the start of a batch until an item was streamed', ('outcome',))
+
+def observe_batch_item(outcome, seconds):
+    batch_items.inc(outcome=outcome)
+    batch_item_latency.observe(seconds, outcome=outcome)
+
 def get_token_from_request():
     """Extract token from Authorization header"""
     auth_header = request.headers.get('Authorization')
@@ -34,11 +171,19 @@ def verify_token(token):
 def require_auth(f):
     """Decorator to ensure user is authenticated"""
     def decorated(*args, **kwargs):
+        # Calls through the gateway carry an identity it already verified
+        with tracing.span('verify_identity'):
+            identity = verify_identity(request.headers.get(IDENTITY_HEADER))
+        if identity is not None:
+            request.user_id = identity.get('user_id')
+            return f(*args, **kwargs)
+
         token = get_token_from_request()
         if not token:
             return jsonify({"error": "Authentication required"}), 401
         
-        payload = verify_token(token)
+        with tracing.span('verify_token'):
+            payload = verify_token(token)
         if not payload:
             return jsonify({"error": "Invalid or expired token"}), 401
         
@@ -47,18 +192,10 @@ def require_auth(f):
     decorated.__name__ = f.__name__
     return decorated
 
-@app.route('/health', methods=['GET'])
-def health_check():
-    return jsonify({"status": "Image generation service is operational"})
-
-@app.route('/generate', methods=['POST'])
-@require_auth
-def generate_image():
-    """Generate an image based on the provided prompt"""
-    data = request.json
-    
+def parse_generation_params(data):
+    """Validate a generation request body into prompt, width and height, raising ValueError"""
     if not data or 'prompt' not in data:
-        return jsonify({"error": "No prompt provided"}), 400
+        raise ValueError("No prompt provided")
     
     prompt = data['prompt']
     width = data.get('width', 512)
@@ -66,32 +203,245 @@ def generate_image():
     
     # Validate parameters
     if not isinstance(prompt, str) or not prompt.strip():
-        return jsonify({"error": "Invalid prompt"}), 400
+        raise ValueError("Invalid prompt")
     
     try:
         width = int(width)
         height = int(height)
-        
-        # Limit dimensions to reasonable values
-        width = max(64, min(width, 1024))
-        height = max(64, min(height, 1024))
-    except:
-        return jsonify({"error": "Invalid dimensions"}), 400
+    except (TypeError, ValueError):
+        raise ValueError("Invalid dimensions")
     
-    # Generate the image
+    # Limit dimensions to reasonable values
+    width = max(64, min(width, 1024))
+    height = max(64, min(height, 1024))
+    return prompt, width, height
+
+def format_names():
+    """Short names of the output formats, as accepted in the `format` field"""
+    return [mimetype.split("/")[1] for mimetype in OUTPUT_FORMATS]
+
+def parse_render_options(data):
+    """
+    Validate the optional `format`, `preset` and `model` fields into a media type (None when
+    no format was asked for), an encoder preset and a model name, raising ValueError
+    """
+    data = data or {}
+    mimetype = None
+    if data.get('format') is not None:
+        name = str(data['format']).lower()
+        mimetype = 'image/jpeg' if name == 'jpg' else f'image/{name}'
+        if mimetype not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported format, expected one of {', '.join(format_names())}")
+    preset = data.get('preset', ENCODER_PRESET)
+    if preset not in PRESETS:
+        raise ValueError(f"Unknown preset, expected one of {', '.join(PRESETS)}")
+    model = data.get('model') or model_registry.default
+    if model not in model_registry.names():
+        raise ValueError(f"Unknown model, expected one of {', '.join(model_registry.names())}")
+    return mimetype, preset, model
+
+def parse_batch_item(data):
+    """A batch item's prompt, width, height, media type, preset and model, raising ValueError"""
+    mimetype, preset, model = parse_render_options(data)
+    return parse_generation_params(data) + (mimetype or 'image/png', preset, model)
+
+def render_coalesced(prompt, width, height, image_format, preset, model, deadline=None):
+    """
+    Encoded image bytes, shared with identical renderings already in flight.
+    Each caller waits until its own deadline; a rendering is bounded by the deadline of
+    the caller running it, and callers it leaves with time to spare render again.
+    """
+    return generation_flight.do(
+        (prompt, width, height, image_format, preset, model),
+        render_image,
+        prompt, width, height, image_format, preset, model,
+        deadline=deadline
+    )
+
+@app.errorhandler(ModelUnavailable)
+def model_unavailable(e):
+    return jsonify({"error": str(e)}), 503
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    return jsonify({"status": "Image generation service is operational"})
+
+@app.route('/generate', methods=['POST'])
+@require_auth
+def generate_image():
+    """
+    Generate an image based on the provided prompt.
+    Clients accepting an image type (e.g. `Accept: image/png`) get the raw image with metadata
+    in headers, everyone else the base64 encoded image in JSON. The body's `format` field picks
+    the encoding, PNG when neither it nor the Accept header names one, `preset` its settings
+    and `model` the model backend.
+    """
+    data = request.get_json(silent=True)
     try:
-        image_data = ImageGenerator.generate_image(prompt, width, height)
+        prompt, width, height = parse_generation_params(data)
+        mimetype, preset, model = parse_render_options(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    if mimetype is None:
+        mimetype = request.accept_mimetypes.best_match(['application/json'] + list(OUTPUT_FORMATS))
+        raw = mimetype in OUTPUT_FORMATS
+    else:
+        raw = request.accept_mimetypes.best_match(['application/json', mimetype]) == mimetype
+    if raw:
+        return generate_raw_image(prompt, width, height, mimetype, preset, model)
+    if mimetype not in OUTPUT_FORMATS:
+        mimetype = 'image/png'
+    
+    # Generate the image, the first caller's deadline bounds a coalesced rendering
+    try:
+        image_data = render_coalesced(
+            prompt, width, height, OUTPUT_FORMATS[mimetype], preset, model, deadline.current_deadline())
+        with tracing.span('base64', bytes=len(image_data)):
+            image_data = base64.b64encode(image_data).decode()
         
         # Return the base64 encoded image data
-        return jsonify({
-            "image": image_data,
-            "prompt": prompt,
-            "width": width,
-            "height": height
-        })
+        with tracing.span('serialize', bytes=len(image_data)):
+            response = jsonify({
+                "image": image_data,
+                "prompt": prompt,
+                "width": width,
+                "height": height,
+                "format": mimetype.split("/")[1],
+                "preset": preset,
+                "model": model
+            })
+            response.vary.add('Accept')
+            return response
+    except (deadline.DeadlineExceeded, ModelUnavailable):
+        raise
     except Exception as e:
         return jsonify({"error": f"Image generation failed: {str(e)}"}), 500
 
+def generate_raw_image(prompt, width, height, mimetype, preset, model):
+    """Respond with the encoded image itself, without base64 or a JSON wrapper"""
+    try:
+        image_data = render_coalesced(
+            prompt, width, height, OUTPUT_FORMATS[mimetype], preset, model, deadline.current_deadline())
+    except (deadline.DeadlineExceeded, ModelUnavailable):
+        raise
+    except Exception as e:
+        return jsonify({"error": f"Image generation failed: {str(e)}"}), 500
+    
+    # The encoder's bytes are the body as is, coalesced callers share them
+    response = app.response_class(image_data, mimetype=mimetype, headers={
+        "X-Image-Width": str(width),
+        "X-Image-Height": str(height),
+        # Percent-encoded, a prompt may hold characters not allowed in headers
+        "X-Image-Prompt": quote(prompt, safe=' ')
+    })
+    response.vary.add('Accept')
+    return response
+
+@app.route('/generate/batch', methods=['POST'])
+@require_auth
+def generate_batch():
+    """
+    Render several images concurrently, streaming each result as soon as it is ready.
+    Results come as newline-delimited JSON by default, or as `multipart/mixed` parts holding
+    the raw images when the client accepts it. Every item reports its own status.
+    """
+    try:
+        items = batch.parse_batch(request.get_json(silent=True), parse_batch_item)
+    except batch.BatchError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    # Rendering starts now, before the first byte of the response is sent
+    results = batch.timed(
+        batch.run_batch(items, render_coalesced, deadline.current_deadline()), observe_batch_item)
+    
+    headers = {"Cache-Control": "no-store", "X-Accel-Buffering": "no"}
+    if request.accept_mimetypes.best_match(batch.BATCH_MEDIA_TYPES) == 'multipart/mixed':
+        boundary = batch.new_boundary()
+        return Response(stream_with_context(batch.multipart_results(results, boundary)),
+                        mimetype=f'multipart/mixed; boundary={boundary}', headers=headers)
+    return Response(stream_with_context(batch.ndjson_results(results)),
+                    mimetype='application/x-ndjson', headers=headers)
+
+@app.route('/jobs', methods=['POST'])
+@require_auth
+def submit_job():
+    """Queue an image generation and return its job ID right away"""
+    data = request.get_json(silent=True)
+    try:
+        prompt, width, height = parse_generation_params(data)
+        mimetype, preset, model = parse_render_options(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    params = {"prompt": prompt, "width": width, "height": height,
+              "format": (mimetype or 'image/png').split("/")[1], "preset": preset, "model": model}
+    job = jobs.new_job(params, request.user_id)
+    try:
+        job_store.enqueue(job)
+    except jobs.QueueFull:
+        return jsonify({"error": "Too many queued jobs, retry later"}), 503, \
+            {"Retry-After": str(job_workers.retry_after())}
+    
+    # Relative, so it also resolves behind the gateway's /api/images prefix
+    return jsonify(jobs.public_view(job)), 202, {"Location": f"jobs/{job['id']}"}
+
+def find_job(job_id):
+    """The job if it belongs to the caller; other users' jobs look missing"""
+    job = job_store.get(job_id)
+    if job is None or job["user_id"] != request.user_id:
+        return None
+    return job
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+@require_auth
+def get_job(job_id):
+    """Get a job's status, and its result once it has succeeded"""
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(jobs.public_view(job)), 200, {"Cache-Control": "no-store"}
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+@require_auth
+def stream_job_events(job_id):
+    """Stream a job's progress as server-sent events, ending with a `done` event"""
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    
+    def events(job):
+        version = -1
+        while job is not None:
+            if job["version"] == version:
+                # Keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+            else:
+                version = job["version"]
+                finished = job["status"] in jobs.FINISHED
+                data = json.dumps(jobs.public_view(job))
+                yield f"id: {version}\nevent: {'done' if finished else 'progress'}\ndata: {data}\n\n"
+                if finished:
+                    return
+            job = job_store.wait(job_id, version, jobs.JOB_EVENTS_HEARTBEAT)
+    
+    return Response(stream_with_context(events(job)), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-store",
+        "X-Accel-Buffering": "no"
+    })
+
+@app.route('/stats', methods=['GET'])
+def get_service_stats():
+    """Get service runtime statistics"""
+    return jsonify({
+        "coalescing": generation_flight.get_stats(),
+        "result_cache": result_cache.get_stats(),
+        "rendering": render_backend.get_stats(),
+        "encoding": encoder_stats.get_stats(),
+        "models": model_registry.get_stats(),
+        "jobs": job_workers.get_stats()
+    })
+
 @app.route('/status', methods=['GET'])
 @require_auth
 def get_service_status():
@@ -102,10 +452,17 @@ def get_service_status():
         "capabilities": {
             "max_width": 1024,
             "max_height": 1024,
-            "formats": ["png"],
-            "models": ["mock-generator"]  # In a real app, this would list the available ML models
+            "formats": format_names(),
+            "presets": list(PRESETS),
+            "default_format": "png",
+            "default_preset": ENCODER_PRESET,
+            "models": [name for name, state in model_registry.get_stats().items() if state["status"] == READY],
+            "default_model": model_registry.default
         }
     })
 
 if __name__ == '__main__':
+    # Speak HTTP/1.1 so the gateway can keep connections alive between requests
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"
+    # Debug mode runs the reloader, see RELOADER_WATCHER
     app.run(host='0.0.0.0', port=5002, debug=True)
\ No newline at end of file
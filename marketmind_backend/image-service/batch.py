@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import base64
+import uuid
+import contextvars
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from common.deadline import DeadlineExceeded
+from image_generator import OUTPUT_FORMATS
+from models import ModelUnavailable
+from rendering import RENDER_PROCESSES
+
+# Batch generation configuration from environment variables
+GENERATE_BATCH_MAX_ITEMS = int(os.environ.get('GENERATE_BATCH_MAX_ITEMS', '16'))
+# Items rendered at once across all batches; with the process backend each waits on a pool worker
+GENERATE_BATCH_WORKERS = int(os.environ.get('GENERATE_BATCH_WORKERS', str(RENDER_PROCESSES)))
+
+# Media types a batch can be streamed as, the first is the default
+BATCH_MEDIA_TYPES = ['application/x-ndjson', 'multipart/mixed']
+
+# Shared by every batch so rendering fan-out stays bounded across concurrent batches
+batch_executor = ThreadPoolExecutor(max_workers=GENERATE_BATCH_WORKERS, thread_name_prefix='batch-render')
+
+
+class BatchError(Exception):
+    """Raised when the batch envelope itself is invalid"""
+
+
+def parse_batch(data, parse_item):
+    """
+    Validate a batch request body into a list of items.
+    Each item is a dict with its index, the client's optional id, and either its
+    parsed params or the error that made it invalid, so one bad item does not reject the batch.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('items'), list):
+        raise BatchError("Expected a JSON object with an 'items' list")
+    specs = data['items']
+    if not specs:
+        raise BatchError("No items provided")
+    if len(specs) > GENERATE_BATCH_MAX_ITEMS:
+        raise BatchError(f"At most {GENERATE_BATCH_MAX_ITEMS} items per batch")
+
+    items = []
+    for index, spec in enumerate(specs):
+        item = {"index": index}
+        if isinstance(spec, dict) and spec.get('id') is not None:
+            item["id"] = str(spec['id'])
+        try:
+            item["params"] = parse_item(spec if isinstance(spec, dict) else None)
+        except ValueError as e:
+            item["error"] = str(e)
+        items.append(item)
+    return items
+
+
+def render_item(item, render, deadline):
+    """Render one item, turning its failure into a result instead of an exception"""
+    result = {key: item[key] for key in ("index", "id") if key in item}
+    if "error" in item:
+        return dict(result, status=400, outcome="invalid", error=item["error"])
+
+    prompt, width, height, mimetype, preset, model = item["params"]
+    try:
+        image_data = render(prompt, width, height, OUTPUT_FORMATS[mimetype], preset, model, deadline=deadline)
+    except DeadlineExceeded:
+        return dict(result, status=504, outcome="deadline", error="Deadline exceeded")
+    except ModelUnavailable as e:
+        return dict(result, status=503, outcome="unavailable", error=str(e))
+    except Exception as e:
+        return dict(result, status=500, outcome="error", error=f"Image generation failed: {str(e)}")
+    return dict(result, status=200, outcome="ok", image_data=image_data,
+                prompt=prompt, width=width, height=height, format=mimetype.split("/")[1], preset=preset, model=model)
+
+
+def run_batch(items, render, deadline=None):
+    """
+    Start rendering every item concurrently and return an iterator of the results
+    as they finish, fastest first.
+    """
+    futures = [
+        # Each item keeps the request's trace context, so its spans join the request's trace
+        batch_executor.submit(contextvars.copy_context().run, render_item, item, render, deadline)
+        for item in items
+    ]
+    return as_finished(futures)
+
+
+def as_finished(futures):
+    # Items not started yet are cancelled when the consumer stops early, e.g. the client went away
+    try:
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def public_fields(result):
+    return {key: value for key, value in result.items() if key not in ("outcome", "image_data")}
+
+
+def ndjson_results(results):
+    """One JSON object per line, images base64 encoded as in /generate's JSON response"""
+    for result in results:
+        line = public_fields(result)
+        if "image_data" in result:
+            line["image"] = base64.b64encode(result["image_data"]).decode()
+        yield json.dumps(line) + "\n"
+
+
+def multipart_results(results, boundary):
+    """
+    One part per result: the raw image with the same metadata headers as /generate's raw
+    responses, or a JSON error body. Parts are binary, so images are not base64 encoded.
+    """
+    for result in results:
+        headers = {"X-Item-Index": str(result["index"]), "X-Item-Status": str(result["status"])}
+        if "id" in result:
+            headers["X-Item-Id"] = quote(result["id"], safe=' ')
+        if "image_data" in result:
+            body = result["image_data"]
+            headers.update({
+                "Content-Type": f"image/{result['format']}",
+                "X-Image-Width": str(result["width"]),
+                "X-Image-Height": str(result["height"]),
+                "X-Image-Prompt": quote(result["prompt"], safe=' ')
+            })
+        else:
+            body = json.dumps(public_fields(result)).encode()
+            headers["Content-Type"] = "application/json"
+        headers["Content-Length"] = str(len(body))
+        head = "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+        yield f"--{boundary}\r\n{head}\r\n".encode() + body + b"\r\n"
+    yield f"--{boundary}--\r\n".encode()
+
+
+def new_boundary():
+    return f"batch-{uuid.uuid4().hex}"
+
+
+def timed(results, observe):
+    """Pass results through, reporting each one's outcome and seconds since the batch started"""
+    started = time.time()
+    for result in results:
+        observe(result["outcome"], time.time() - started)
+        yield result
@@ -0,0 +1,273 @@
+import os
+import json
+import base64
+import math
+import time
+import uuid
+import threading
+from collections import deque
+
+try:
+    import redis
+except ImportError:  # Only needed for JOB_BACKEND=redis
+    redis = None
+
+from image_generator import ENCODER_PRESET, OUTPUT_FORMATS
+from rendering import render_image
+
+# Job queue configuration from environment variables
+JOB_BACKEND = os.environ.get('JOB_BACKEND', 'memory')  # 'memory' or 'redis'
+JOB_REDIS_URL = os.environ.get('JOB_REDIS_URL', 'redis://localhost:6379/1')
+# Worker threads consuming the queue in this process; 0 leaves the work to standalone workers (worker.py)
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', '64'))
+# Seconds a finished job stays available to GET /jobs/<id>
+JOB_TTL = float(os.environ.get('JOB_TTL', '600'))
+# Seconds between keep-alive comments on an idle event stream
+JOB_EVENTS_HEARTBEAT = float(os.environ.get('JOB_EVENTS_HEARTBEAT', '10'))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = 'queued', 'running', 'succeeded', 'failed'
+FINISHED = (SUCCEEDED, FAILED)
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue is at its bound"""
+
+
+def new_job(params, user_id):
+    """A queued job record; `version` increases with every update"""
+    return {
+        "id": uuid.uuid4().hex,
+        "status": QUEUED,
+        "stage": None,
+        "progress": 0.0,
+        "params": params,
+        "user_id": user_id,
+        "result": None,
+        "error": None,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        "version": 0
+    }
+
+
+def public_view(job):
+    """The fields of a job returned to its owner"""
+    view = {key: job[key] for key in
+            ("id", "status", "stage", "progress", "error", "created_at", "started_at", "finished_at")}
+    if job["status"] == SUCCEEDED:
+        view["result"] = job["result"]
+    return view
+
+
+class MemoryJobStore:
+    """
+    Jobs and a bounded FIFO queue kept in this process.
+    Only workers in the same process can consume it.
+    """
+
+    def __init__(self, max_queued=JOB_QUEUE_SIZE, ttl=JOB_TTL):
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self._changed = threading.Condition()
+        self._jobs = {}
+        self._queue = deque()
+
+    def enqueue(self, job):
+        with self._changed:
+            self._expire()
+            if len(self._queue) >= self.max_queued:
+                raise QueueFull("Job queue is full")
+            self._jobs[job["id"]] = dict(job)
+            self._queue.append(job["id"])
+            self._changed.notify_all()
+
+    def dequeue(self, timeout):
+        """Take the oldest queued job ID, or None after timeout seconds"""
+        with self._changed:
+            if not self._changed.wait_for(lambda: self._queue, timeout):
+                return None
+            return self._queue.popleft()
+
+    def get(self, job_id):
+        with self._changed:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def update(self, job_id, **fields):
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(fields, version=job["version"] + 1)
+            self._changed.notify_all()
+
+    def wait(self, job_id, version, timeout):
+        """Return the job once its version is past `version`, or as it is after timeout seconds"""
+        with self._changed:
+            self._changed.wait_for(
+                lambda: self._jobs.get(job_id, {}).get("version", version + 1) > version, timeout)
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def depth(self):
+        with self._changed:
+            return len(self._queue)
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job["finished_at"] is not None and job["finished_at"] < cutoff]:
+            del self._jobs[job_id]
+
+
+# Push only while the queue is below its bound, in one step so concurrent producers cannot overshoot it
+ENQUEUE_SCRIPT = """
+local depth = redis.call('LLEN', KEYS[1])
+if depth >= tonumber(ARGV[1]) then
+    return -1
+end
+redis.call('SET', KEYS[2], ARGV[2])
+redis.call('LPUSH', KEYS[1], ARGV[3])
+return depth
+"""
+
+
+class RedisJobStore:
+    """
+    Jobs and a bounded queue shared through Redis, so the HTTP service and
+    standalone workers (worker.py) can run and scale as separate processes.
+    Finished jobs expire after the TTL.
+    """
+
+    def __init__(self, url=JOB_REDIS_URL, max_queued=JOB_QUEUE_SIZE, ttl=JOB_TTL,
+                 key_prefix='jobs:', poll_interval=0.25):
+        if redis is None:
+            raise RuntimeError("JOB_BACKEND=redis requires the redis package")
+        self.client = redis.Redis.from_url(url)
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+        self.poll_interval = poll_interval
+        self.queue_key = key_prefix + 'queue'
+        self._enqueue = self.client.register_script(ENQUEUE_SCRIPT)
+
+    def _key(self, job_id):
+        return f"{self.key_prefix}job:{job_id}"
+
+    def enqueue(self, job):
+        depth = self._enqueue(keys=[self.queue_key, self._key(job["id"])],
+                              args=[self.max_queued, json.dumps(job), job["id"]])
+        if depth < 0:
+            raise QueueFull("Job queue is full")
+
+    def dequeue(self, timeout):
+        popped = self.client.brpop(self.queue_key, timeout=max(1, int(timeout)))
+        return popped[1].decode() if popped else None
+
+    def get(self, job_id):
+        value = self.client.get(self._key(job_id))
+        return json.loads(value) if value is not None else None
+
+    def update(self, job_id, **fields):
+        # Only the worker running a job writes to it, so read-modify-write is safe
+        job = self.get(job_id)
+        if job is None:
+            return
+        job.update(fields, version=job["version"] + 1)
+        expire = self.ttl if job["status"] in FINISHED else None
+        self.client.set(self._key(job_id), json.dumps(job), ex=int(expire) if expire else None)
+
+    def wait(self, job_id, version, timeout):
+        """Return the job once its version is past `version`, or as it is after timeout seconds"""
+        give_up = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job["version"] > version or time.monotonic() >= give_up:
+                return job
+            time.sleep(self.poll_interval)
+
+    def depth(self):
+        return self.client.llen(self.queue_key)
+
+
+def make_store(backend=JOB_BACKEND):
+    return RedisJobStore() if backend == 'redis' else MemoryJobStore()
+
+
+def render_job(params, progress):
+    """Run a generation job, returning the same fields as POST /generate"""
+    # Jobs queued before formats and models were selectable lack those fields
+    image_format = OUTPUT_FORMATS[f"image/{params.get('format', 'png')}"]
+    image_data = render_image(params["prompt"], params["width"], params["height"], image_format,
+                              params.get("preset", ENCODER_PRESET), params.get("model"), progress=progress)
+    return {"image": base64.b64encode(image_data).decode(), **params}
+
+
+class JobWorkerPool:
+    """Threads taking jobs off a store's queue and running them with a handler"""
+
+    def __init__(self, store, handler=render_job, workers=JOB_WORKERS):
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._running = 0
+        self._outcomes = {SUCCEEDED: 0, FAILED: 0}
+        self._run_time = 0.0
+
+    def start(self):
+        for i in range(self.workers):
+            threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True).start()
+        return self
+
+    def _run(self):
+        while True:
+            job_id = self.store.dequeue(timeout=5)
+            if job_id is not None:
+                self.run_job(job_id)
+
+    def run_job(self, job_id):
+        job = self.store.get(job_id)
+        if job is None:
+            return
+        with self._lock:
+            self._running += 1
+        started = time.time()
+        self.store.update(job_id, status=RUNNING, started_at=started)
+
+        def progress(stage, fraction):
+            self.store.update(job_id, stage=stage, progress=round(fraction, 3))
+
+        try:
+            result = self.handler(job["params"], progress)
+            outcome = dict(status=SUCCEEDED, result=result, progress=1.0)
+        except Exception as e:
+            outcome = dict(status=FAILED, error=str(e))
+        finished = time.time()
+        self.store.update(job_id, finished_at=finished, **outcome)
+        with self._lock:
+            self._running -= 1
+            self._outcomes[outcome["status"]] += 1
+            self._run_time += finished - started
+
+    def retry_after(self):
+        """Estimate seconds until the queue has room again"""
+        with self._lock:
+            finished = sum(self._outcomes.values())
+            per_job = self._run_time / finished if finished else 1.0
+        return max(1, math.ceil(per_job * self.store.depth() / max(1, self.workers)))
+
+    def get_stats(self):
+        """Get job queue and worker statistics"""
+        with self._lock:
+            finished = sum(self._outcomes.values())
+            return {
+                "backend": type(self.store).__name__,
+                "workers": self.workers,
+                "queued": self.store.depth(),
+                "running": self._running,
+                **self._outcomes,
+                "mean_run_seconds": round(self._run_time / finished, 4) if finished else None
+            }
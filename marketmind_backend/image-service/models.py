@@ -0,0 +1,326 @@
+"""
+Model backends the image service can generate with, loaded once at startup and kept warm.
+
+A backend turns a prompt into a PIL image; image_generator encodes it. Requests pick one
+by name with a `model` field. Besides the mock generator, a backend can serve the LoRA
+weights written by AI/image_generation_models/SDXL/LMAO/sdxl-finetuning.py on top of SDXL.
+"""
+import os
+import time
+import hashlib
+import threading
+
+try:
+    import torch
+    import diffusers
+except ImportError:  # Only needed for diffusion backends
+    torch = None
+    diffusers = None
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from common.deadline import check_deadline
+from image_generator import GENERATION_STAGES, OUTPUT_STAGES, ImageGenerator
+
+# Model configuration from environment variables
+# Comma separated backends to load, 'name' for built-in ones or 'name=directory' for an SDXL LoRA,
+# the directory being the '<training_folder>/<name>_final' output of the fine-tuning script
+IMAGE_MODELS = os.environ.get('IMAGE_MODELS', 'mock-generator')
+# Used by requests without a `model` field, the first configured backend when empty
+DEFAULT_MODEL = os.environ.get('DEFAULT_MODEL', '')
+# Model ID or directory of the base pipeline, the one named in the LoRA's training config when empty
+SDXL_BASE_MODEL = os.environ.get('SDXL_BASE_MODEL', '')
+SDXL_DEVICE = os.environ.get('SDXL_DEVICE', '')  # cuda when available, else cpu
+SDXL_STEPS = int(os.environ.get('SDXL_STEPS', '30'))
+SDXL_GUIDANCE_SCALE = float(os.environ.get('SDXL_GUIDANCE_SCALE', '7.5'))
+
+MOCK_MODEL = 'mock-generator'
+LOADING, READY, FAILED = 'loading', 'ready', 'failed'
+
+
+class UnknownModel(Exception):
+    """Raised for a model name that is not configured"""
+
+
+class ModelUnavailable(Exception):
+    """Raised for a configured model that failed to load or is still loading"""
+
+
+class ModelBackend:
+    """
+    Interface of a model backend.
+    `load` runs once before the backend serves requests; `generate` must be safe to call from
+    several threads. `version` changes whenever the same prompt starts producing a different image,
+    it is part of every result cache key.
+    """
+
+    name = None
+    version = None
+    # Stages reported by generate, before the image is encoded
+    stages = ()
+    # Whether renderings can run in the process pool's forked workers
+    poolable = False
+
+    def load(self):
+        pass
+
+    def generate(self, prompt, width, height, begin, deadline=None):
+        """A PIL image for the prompt; calls begin(stage) as each of `stages` starts"""
+        raise NotImplementedError
+
+    def memory_bytes(self):
+        """Bytes of weights held by the backend"""
+        return 0
+
+
+class MockBackend(ModelBackend):
+    """The procedural mock generator, cheap enough to render anywhere"""
+
+    stages = GENERATION_STAGES[:-len(OUTPUT_STAGES)]
+    poolable = True
+
+    def __init__(self, name=MOCK_MODEL):
+        self.name = name
+        self.version = ImageGenerator.VERSION
+
+    def load(self):
+        # Nothing to load, drawing one small picture warms the code paths
+        ImageGenerator.render_mock('warm up', 64, 64, lambda stage: None)
+
+    def generate(self, prompt, width, height, begin, deadline=None):
+        return ImageGenerator.render_mock(prompt, width, height, begin)
+
+
+def load_lora_state_dict(path):
+    """
+    LoRA weights saved by the fine-tuning script. It writes them with torch.save despite the
+    .safetensors name, so the file is told apart by its contents: torch files are zip archives.
+    """
+    with open(path, 'rb') as f:
+        if f.read(2) == b'PK':
+            f.seek(0)
+            # Read from the file object, given the path recent torch versions pick a loader by its extension
+            return torch.load(f, map_location='cpu', weights_only=True)
+    from safetensors.torch import load_file
+    return load_file(path)
+
+
+def apply_lora(module, state_dict, target_modules, rank, alpha):
+    """
+    Wrap a module with LoRA adapters as the fine-tuning script did, load the trained weights
+    and merge them into the base weights, so inference runs on a plain module at no extra cost.
+    Weights are named with or without the adapter name, as saved from the wrapper's parameters
+    or by peft's get_peft_model_state_dict.
+    """
+    from peft import LoraConfig, get_peft_model, set_peft_model_state_dict
+    peft_model = get_peft_model(module, LoraConfig(
+        r=rank, lora_alpha=alpha, target_modules=target_modules, lora_dropout=0.0, bias="none"))
+    result = set_peft_model_state_dict(peft_model, state_dict)
+    missing = [key for key in result.missing_keys if 'lora_' in key]
+    if result.unexpected_keys or missing:
+        raise ValueError(f"LoRA weights do not match the model: {(result.unexpected_keys or missing)[:3]}")
+    return peft_model.merge_and_unload()
+
+
+def load_sdxl_pipeline(base_model, dtype, device):
+    """The SDXL text-to-image pipeline from a model ID or directory"""
+    pipeline = diffusers.StableDiffusionXLPipeline.from_pretrained(base_model, torch_dtype=dtype)
+    pipeline.set_progress_bar_config(disable=True)
+    return pipeline.to(device)
+
+
+class SdxlLoraBackend(ModelBackend):
+    """
+    SDXL with LoRA weights from the fine-tuning script merged in.
+    The pipeline is built by `pipeline_factory(base_model, dtype, device)`, which tests can
+    replace with one building a tiny randomly initialized pipeline. A pipeline runs one
+    generation at a time, concurrent requests wait for it.
+    """
+
+    stages = ('denoise',)
+    # Forked workers cannot use a GPU initialized in the parent, and the weights are too large to copy
+    poolable = False
+
+    # Modules the fine-tuning script adds adapters to
+    UNET_TARGET_MODULES = ["to_q", "to_k", "to_v", "to_out.0", "proj_in", "proj_out", "ff.net.0.proj", "ff.net.2"]
+    TEXT_ENCODER_TARGET_MODULES = ["q_proj", "k_proj", "v_proj", "out_proj"]
+
+    def __init__(self, name, lora_dir=None, base_model=SDXL_BASE_MODEL, device=SDXL_DEVICE,
+                 steps=SDXL_STEPS, guidance_scale=SDXL_GUIDANCE_SCALE, pipeline_factory=load_sdxl_pipeline):
+        self.name = name
+        self.lora_dir = lora_dir
+        self.base_model = base_model
+        self.device = device
+        self.steps = steps
+        self.guidance_scale = guidance_scale
+        self.pipeline_factory = pipeline_factory
+        self.negative_prompt = None
+        self.trigger_word = None
+        self.version = None
+        self.pipeline = None
+        self._lock = threading.Lock()
+
+    def _training_config(self):
+        """The config.yaml saved next to the weights, with the rank, alpha and sampling settings"""
+        path = os.path.join(self.lora_dir, 'config.yaml')
+        if yaml is None or not os.path.exists(path):
+            raise RuntimeError(f"Missing {path}, needed for the LoRA rank and alpha (and the pyyaml package)")
+        with open(path) as f:
+            return yaml.safe_load(f)
+
+    def load(self):
+        if torch is None:
+            raise RuntimeError("Diffusion backends need the torch, diffusers and peft packages")
+        device = self.device or ('cuda' if torch.cuda.is_available() else 'cpu')
+        config = self._training_config() if self.lora_dir else {}
+        # Half precision is only worth it, and only well supported, on a GPU
+        dtype = torch.float16 if config.get('dtype', 'fp16') == 'fp16' and device != 'cpu' else torch.float32
+        base_model = (self.base_model or config.get('model', {}).get('name_or_path')
+                      or 'stabilityai/stable-diffusion-xl-base-1.0')
+        pipeline = self.pipeline_factory(base_model, dtype, device)
+
+        digest = hashlib.sha256(f"{base_model}:{self.steps}:{self.guidance_scale}".encode())
+        if self.lora_dir:
+            network = config['config']['network']
+            rank, alpha = network['linear'], network.get('linear_alpha', network['linear'])
+            for component, filename, targets in (
+                    ('unet', 'unet_lora_state_dict.safetensors', self.UNET_TARGET_MODULES),
+                    ('text_encoder', 'text_encoder_lora_state_dict.safetensors', self.TEXT_ENCODER_TARGET_MODULES),
+                    ('text_encoder_2', 'text_encoder_2_lora_state_dict.safetensors', self.TEXT_ENCODER_TARGET_MODULES)):
+                path = os.path.join(self.lora_dir, filename)
+                if not os.path.exists(path):
+                    # Text encoders only have weights when they were trained too
+                    if component == 'unet':
+                        raise RuntimeError(f"Missing {path}")
+                    continue
+                with open(path, 'rb') as f:
+                    digest.update(hashlib.sha256(f.read()).digest())
+                merged = apply_lora(getattr(pipeline, component), load_lora_state_dict(path), targets, rank, alpha)
+                setattr(pipeline, component, merged.to(device, dtype))
+            self.trigger_word = config['config'].get('trigger_word')
+            self.negative_prompt = config.get('sample', {}).get('neg') or None
+            digest.update(str(self.negative_prompt).encode())
+
+        self.pipeline = pipeline
+        self.version = f"sdxl-{digest.hexdigest()[:16]}"
+
+    def generate(self, prompt, width, height, begin, deadline=None):
+        # The fine-tuned style is keyed to its trigger word, written as '[word]' in the training captions
+        if self.trigger_word and self.trigger_word not in prompt:
+            prompt = f"[{self.trigger_word}] {prompt}"
+        # The latent space is an eighth of the image size, other sizes are resized afterwards
+        latent_width, latent_height = max(8, width // 8 * 8), max(8, height // 8 * 8)
+
+        def on_step_end(pipeline, step, timestep, callback_kwargs):
+            # Checked between denoising steps, the longest part of a generation
+            check_deadline(deadline, 'denoise')
+            return callback_kwargs
+
+        with self._lock:
+            begin('denoise', steps=self.steps)
+            # Seeded from the prompt, the same request gives the same image and can be cached
+            seed = int.from_bytes(hashlib.sha256(prompt.encode()).digest()[:4], 'big')
+            image = self.pipeline(
+                prompt=prompt,
+                negative_prompt=self.negative_prompt,
+                width=latent_width,
+                height=latent_height,
+                num_inference_steps=self.steps,
+                guidance_scale=self.guidance_scale,
+                generator=torch.Generator(device='cpu').manual_seed(seed),
+                callback_on_step_end=on_step_end
+            ).images[0]
+        image = image.convert('RGB')
+        if image.size != (width, height):
+            image = image.resize((width, height))
+        return image
+
+    def memory_bytes(self):
+        if self.pipeline is None:
+            return 0
+        total = 0
+        for component in self.pipeline.components.values():
+            if isinstance(component, torch.nn.Module):
+                for tensor in list(component.parameters()) + list(component.buffers()):
+                    total += tensor.numel() * tensor.element_size()
+        return total
+
+
+class ModelRegistry:
+    """Configured backends by name, with their load state, time and memory"""
+
+    def __init__(self, backends, default=None):
+        self._backends = {backend.name: backend for backend in backends}
+        self.default = default or next(iter(self._backends))
+        if self.default not in self._backends:
+            raise ValueError(f"Default model {self.default} is not configured")
+        self._lock = threading.Lock()
+        self._state = {name: {"status": LOADING, "load_seconds": None, "memory_bytes": 0, "error": None}
+                       for name in self._backends}
+
+    def names(self):
+        return list(self._backends)
+
+    def load_all(self):
+        """
+        Load every backend, one after the other. A backend that fails to load is reported
+        and its requests answered as unavailable; the others keep serving.
+        """
+        for name, backend in self._backends.items():
+            started = time.time()
+            try:
+                backend.load()
+            except Exception as e:
+                print(f"Error loading model {name}: {e}")
+                self._update(name, status=FAILED, error=str(e))
+                continue
+            self._update(name, status=READY, load_seconds=round(time.time() - started, 3),
+                         memory_bytes=backend.memory_bytes())
+            print(f"Loaded model {name} in {time.time() - started:.1f}s")
+        return self
+
+    def _update(self, name, **fields):
+        with self._lock:
+            self._state[name].update(fields)
+
+    def get(self, name=None):
+        """The ready backend of that name, or the default one"""
+        name = name or self.default
+        if name not in self._backends:
+            raise UnknownModel(name)
+        with self._lock:
+            state = dict(self._state[name])
+        if state["status"] == FAILED:
+            raise ModelUnavailable(f"Model {name} failed to load: {state['error']}")
+        if state["status"] != READY:
+            raise ModelUnavailable(f"Model {name} is still loading")
+        return self._backends[name]
+
+    def get_stats(self):
+        with self._lock:
+            return {name: dict(state, default=name == self.default) for name, state in self._state.items()}
+
+
+def parse_models(value=IMAGE_MODELS):
+    """Backends for the IMAGE_MODELS setting"""
+    backends = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if '=' in item:
+            name, lora_dir = (part.strip() for part in item.split('=', 1))
+            # An empty directory serves the base model alone
+            backends.append(SdxlLoraBackend(name, lora_dir or None))
+        elif item == MOCK_MODEL:
+            backends.append(MockBackend())
+        else:
+            raise ValueError(f"Unknown built-in model {item}, use 'name=directory' for a LoRA")
+    return backends
+
+
+# Backends of this process, loaded by the service and standalone workers on start
+registry = ModelRegistry(parse_models(), DEFAULT_MODEL or None)
@@ -0,0 +1,43 @@
+"""
+Code run inside the rendering worker processes of rendering.ProcessPoolBackend.
+It is all the workers import, so it must not import app, models or anything that starts threads.
+Encoded images come back through shared memory blocks instead of being pickled
+through the pool's result pipe; the parent process copies them out and unlinks them.
+"""
+from multiprocessing import resource_tracker, shared_memory
+from common import tracing
+from common.deadline import DeadlineExceeded
+import image_generator
+from image_generator import ImageGenerator
+
+
+def init_worker(warm_start):
+    """Start a worker process, rendering one small image first when warm_start is set"""
+    # Spans are not exported from workers
+    tracing.init_tracer('image-render-worker', exporter_name='none')
+    if warm_start:
+        # Loads the encoder plugins and touches every code path once, before real requests arrive
+        ImageGenerator.generate_image_bytes('warm up', 64, 64, fallback=False)
+        image_generator.encoder_stats.drain()
+
+
+def render_to_shared_memory(prompt, width, height, image_format, preset, deadline):
+    """
+    Render an image into a new shared memory block.
+    Returns ('ok', block name, size, encoder stats), ('deadline', stage) or ('error', message);
+    exceptions are returned rather than raised since DeadlineExceeded does not survive pickling intact.
+    """
+    try:
+        image_data = ImageGenerator.generate_image_bytes(
+            prompt, width, height, image_format, deadline=deadline, fallback=False, preset=preset)
+    except DeadlineExceeded as e:
+        return 'deadline', e.stage
+    except Exception as e:
+        return 'error', f"{type(e).__name__}: {e}"
+    block = shared_memory.SharedMemory(create=True, size=max(1, len(image_data)))
+    block.buf[:len(image_data)] = image_data
+    block.close()
+    # The parent unlinks the block once it has read it; a recycled worker must not clean it up first
+    resource_tracker.unregister(block._name, 'shared_memory')
+    # This rendering's encode, merged into the parent's stats
+    return 'ok', block.name, len(image_data), image_generator.encoder_stats.drain()
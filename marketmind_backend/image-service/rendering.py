@@ -0,0 +1,174 @@
+import os
+import sys
+import threading
+import multiprocessing
+from importlib.machinery import ModuleSpec
+from multiprocessing import resource_tracker, shared_memory
+from common import tracing
+from common.deadline import DeadlineExceeded
+import image_generator
+from image_generator import ENCODER_PRESET, ImageGenerator
+from models import registry
+from result_cache import ResultCache, make_key
+
+# Rendering backend configuration from environment variables
+RENDER_BACKEND = os.environ.get('RENDER_BACKEND', 'inline')  # 'inline' or 'process'
+RENDER_PROCESSES = int(os.environ.get('RENDER_PROCESSES', str(os.cpu_count() or 1)))
+# Worker processes are replaced after this many renderings, bounding leaks and fragmentation
+RENDER_MAX_TASKS_PER_CHILD = int(os.environ.get('RENDER_MAX_TASKS_PER_CHILD', '500'))
+RENDER_WARM_START = os.environ.get('RENDER_WARM_START', 'true').lower() == 'true'
+# Workers start from a clean process, never forked from the multithreaded service
+RENDER_START_METHOD = os.environ.get('RENDER_START_METHOD', 'forkserver')  # or 'spawn'
+
+
+class InlineBackend:
+    """Renders on the calling thread"""
+
+    def render(self, prompt, width, height, image_format, preset=ENCODER_PRESET, deadline=None, progress=None,
+               model=None):
+        return ImageGenerator.generate_image_bytes(
+            prompt, width, height, image_format, deadline=deadline, progress=progress, fallback=False, preset=preset,
+            model=model)
+
+    def get_stats(self):
+        return {"backend": "inline"}
+
+
+class ProcessPoolBackend:
+    """
+    Renders in a pool of worker processes so renderings run in parallel outside the GIL.
+    Workers run render_worker only: with the forkserver start method they are forked from a
+    server process that preloaded it, so recycled workers start quickly without being forked
+    from the service's threads. The pool starts on the first rendering, so a process that
+    never renders, like the debug reloader's watcher, starts none.
+    Stage progress is not reported from workers. Only the mock generator renders here,
+    see ModelBackend.poolable.
+    """
+
+    def __init__(self, processes=RENDER_PROCESSES, max_tasks_per_child=RENDER_MAX_TASKS_PER_CHILD,
+                 warm_start=RENDER_WARM_START, start_method=RENDER_START_METHOD):
+        self.processes = processes
+        self.max_tasks_per_child = max_tasks_per_child
+        self.warm_start = warm_start
+        self.start_method = start_method
+        self.pool = None
+        self._render = None
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._outcomes = {"ok": 0, "deadline": 0, "error": 0}
+        self._bytes = 0
+
+    def _start(self):
+        """Create the pool, called with the lock held"""
+        # Imported here so the worker module is only loaded where a pool is used
+        import render_worker
+        context = multiprocessing.get_context(self.start_method)
+        if self.start_method == 'forkserver':
+            context.set_forkserver_preload(['render_worker'])
+        # Started workers run the parent's __main__ again unless it is marked as not importable;
+        # app.py run directly would then load the models and start job workers in each of them
+        main = sys.modules['__main__']
+        if getattr(main, '__spec__', None) is None:
+            main.__spec__ = ModuleSpec('__main__', None)
+        # Started before the workers so they share it instead of each starting their own
+        resource_tracker.ensure_running()
+        self._render = render_worker.render_to_shared_memory
+        self.pool = context.Pool(
+            self.processes, initializer=render_worker.init_worker, initargs=(self.warm_start,),
+            maxtasksperchild=self.max_tasks_per_child or None)
+
+    def render(self, prompt, width, height, image_format, preset=ENCODER_PRESET, deadline=None, progress=None):
+        with self._lock:
+            if self.pool is None:
+                self._start()
+            self._in_flight += 1
+        try:
+            with tracing.span('render_process', width=width, height=height):
+                # Workers check the deadline between stages, so a late task returns quickly
+                status, *result = self.pool.apply(self._render, (prompt, width, height, image_format, preset, deadline))
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+        with self._lock:
+            self._outcomes[status] += 1
+        if status == 'deadline':
+            raise DeadlineExceeded(result[0])
+        if status == 'error':
+            print(f"Error generating image: {result[0]}")
+            raise RuntimeError(result[0])
+
+        name, size, encodes = result
+        image_generator.encoder_stats.merge(encodes)
+        block = shared_memory.SharedMemory(name=name)
+        try:
+            # The one copy out of the block, the response and the cache hold these bytes
+            image_data = bytes(block.buf[:size])
+        finally:
+            block.close()
+            block.unlink()
+        with self._lock:
+            self._bytes += size
+        return image_data
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "backend": "process",
+                "start_method": self.start_method,
+                "started": self.pool is not None,
+                "processes": self.processes,
+                "max_tasks_per_child": self.max_tasks_per_child,
+                "in_flight": self._in_flight,
+                "outcomes": dict(self._outcomes),
+                "bytes": self._bytes
+            }
+
+
+def make_backend(backend=RENDER_BACKEND):
+    return ProcessPoolBackend() if backend == 'process' else InlineBackend()
+
+
+# Encoded images rendered before, shared by the request handlers and job workers of this process
+result_cache = ResultCache()
+render_backend = make_backend()
+# Models that cannot use the pool render on the request or job thread
+inline_backend = InlineBackend()
+
+
+def cache_key(prompt, width, height, image_format, preset, model):
+    """Content address of a rendering: its parameters, the model backend and its version"""
+    return make_key(prompt=prompt, width=width, height=height, format=image_format.upper(), preset=preset,
+                    model=model.name, version=model.version)
+
+
+def render_image(prompt, width, height, image_format='PNG', preset=ENCODER_PRESET, model=None, deadline=None,
+                 progress=None):
+    """
+    Encoded image bytes for the parameters, from the result cache when they were rendered before.
+    `model` names the model backend, the default one when None.
+    A failed rendering is answered with the error image, which is never cached.
+    
+    Raises:
+        UnknownModel, ModelUnavailable: If the model is not configured or not loaded
+        DeadlineExceeded: If the deadline passes before the image is finished
+    """
+    backend = registry.get(model)
+    key = cache_key(prompt, width, height, image_format, preset, backend)
+    image_data = result_cache.get(key)
+    if image_data is not None:
+        return image_data
+    try:
+        if backend.poolable:
+            # The pool's workers render the mock themselves
+            image_data = render_backend.render(
+                prompt, width, height, image_format, preset, deadline=deadline, progress=progress)
+        else:
+            image_data = inline_backend.render(
+                prompt, width, height, image_format, preset, deadline=deadline, progress=progress, model=backend)
+    except DeadlineExceeded:
+        raise
+    except Exception:
+        return ImageGenerator.error_image_bytes(width, height, image_format)
+    result_cache.put(key, image_data)
+    return image_data
@@ -0,0 +1,217 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Result cache configuration from environment variables
+RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', 'true').lower() == 'true'
+RESULT_CACHE_MEMORY_BYTES = int(os.environ.get('RESULT_CACHE_MEMORY_BYTES', str(64 * 1024 * 1024)))
+# Directory of the disk tier, empty to keep results in memory only
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'marketmind-image-cache'))
+RESULT_CACHE_DISK_BYTES = int(os.environ.get('RESULT_CACHE_DISK_BYTES', str(1024 * 1024 * 1024)))
+
+
+def make_key(**params):
+    """Hash of every parameter that determines a result, in a canonical order"""
+    canonical = json.dumps(params, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class MemoryTier:
+    """LRU of results bounded by their total size in bytes"""
+
+    def __init__(self, max_bytes=RESULT_CACHE_MEMORY_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.bytes = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        # A result larger than the whole tier would only flush everything else
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= len(previous)
+            self._entries[key] = data
+            self.bytes += len(data)
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.evictions += 1
+
+    def get_stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                    "evictions": self.evictions}
+
+
+class DiskTier:
+    """
+    Results stored as files named after their key, bounded by total size.
+    The least recently used files are deleted first; the index is rebuilt
+    from the directory on start so the tier survives restarts.
+    """
+
+    def __init__(self, directory=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_DISK_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._sizes = OrderedDict()  # key -> file size, least recently used first
+        self.bytes = 0
+        self.evictions = 0
+        self.errors = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _path(self, key):
+        # Two character fan-out keeps directories small
+        return os.path.join(self.directory, key[:2], key)
+
+    def _load_index(self):
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                if name.startswith('.'):
+                    # Partial write left behind by a crash
+                    os.unlink(path)
+                    continue
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name, stat.st_size))
+        for _, key, size in sorted(files):
+            self._sizes[key] = size
+            self.bytes += size
+        self._evict()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._sizes:
+                return None
+            self._sizes.move_to_end(key)
+        try:
+            with open(self._path(key), 'rb') as f:
+                data = f.read()
+            os.utime(self._path(key))
+            return data
+        except OSError:
+            # Removed underneath us, e.g. by another process sharing the directory
+            self._forget(key)
+            return None
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written under a temporary name and renamed, readers never see a partial file
+            fd, temp_path = tempfile.mkstemp(prefix='.', dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            with self._lock:
+                self.errors += 1
+            print(f"Error writing result cache file: {e}")
+            return
+        with self._lock:
+            self.bytes += len(data) - self._sizes.pop(key, 0)
+            self._sizes[key] = len(data)
+            self._evict()
+
+    def _forget(self, key):
+        with self._lock:
+            self.bytes -= self._sizes.pop(key, 0)
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and self._sizes:
+            key, size = self._sizes.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+            try:
+                os.unlink(self._path(key))
+            except OSError:
+                pass
+
+    def get_stats(self):
+        with self._lock:
+            return {"entries": len(self._sizes), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                    "evictions": self.evictions, "errors": self.errors}
+
+
+class ResultCache:
+    """
+    Two-tier cache of encoded results: a memory LRU in front of a disk tier.
+    Disk hits are promoted into memory.
+    """
+
+    def __init__(self, memory=None, disk=None, enabled=RESULT_CACHE_ENABLED):
+        self.enabled = enabled
+        self.memory = memory if memory is not None else MemoryTier()
+        if disk is None and enabled and RESULT_CACHE_DIR:
+            try:
+                disk = DiskTier()
+            except OSError as e:
+                print(f"Result cache disk tier disabled: {e}")
+        self.disk = disk
+
+        self._lock = threading.Lock()
+        self._lookups = {"memory": 0, "disk": 0, "miss": 0}
+        self._bytes_served = {"memory": 0, "disk": 0}
+
+    def _record(self, result, size=0):
+        with self._lock:
+            self._lookups[result] += 1
+            if size:
+                self._bytes_served[result] += size
+
+    def get(self, key):
+        """The cached result for a key, or None"""
+        if not self.enabled:
+            return None
+        data = self.memory.get(key)
+        if data is not None:
+            self._record("memory", len(data))
+            return data
+        if self.disk is not None:
+            data = self.disk.get(key)
+            if data is not None:
+                self.memory.put(key, data)
+                self._record("disk", len(data))
+                return data
+        self._record("miss")
+        return None
+
+    def put(self, key, data):
+        if not self.enabled:
+            return
+        self.memory.put(key, data)
+        if self.disk is not None:
+            self.disk.put(key, data)
+
+    def get_stats(self):
+        """Get result cache statistics"""
+        with self._lock:
+            lookups = dict(self._lookups)
+            bytes_served = dict(self._bytes_served)
+        total = sum(lookups.values())
+        return {
+            "enabled": self.enabled,
+            "lookups": lookups,
+            "hit_ratio": round((lookups["memory"] + lookups["disk"]) / total, 4) if total else None,
+            "bytes_served": bytes_served,
+            "memory": self.memory.get_stats(),
+            "disk": self.disk.get_stats() if self.disk is not None else None
+        }
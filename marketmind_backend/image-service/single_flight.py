@@ -0,0 +1,82 @@
+import time
+import threading
+from common.deadline import DeadlineExceeded, remaining
+
+
+class _Call:
+    """An in-flight computation shared by every caller with the same key"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls into a single in-flight computation.
+    The first caller for a key runs the function, callers arriving while it
+    runs wait for it and receive the same result (or exception).
+    Every caller has its own deadline: it stops waiting when that passes, and when
+    the run stops at its runner's earlier deadline, callers with time left run it again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._executions = 0
+        self._coalesced = 0
+        self._retried = 0
+
+    def do(self, key, fn, *args, deadline=None, **kwargs):
+        """
+        Run fn once per key among concurrent callers and return its result.
+        `deadline` is this caller's, passed on to fn when this caller runs it.
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                if call is not None:
+                    call.waiters += 1
+                    self._coalesced += 1
+                    leader = False
+                else:
+                    call = _Call()
+                    self._calls[key] = call
+                    self._executions += 1
+                    leader = True
+
+            if leader:
+                break
+            # A negative timeout returns at once, None waits for the run
+            if not call.done.wait(timeout=remaining(deadline)):
+                raise DeadlineExceeded('coalesced rendering')
+            if isinstance(call.error, DeadlineExceeded) and (deadline is None or time.time() < deadline):
+                with self._lock:
+                    self._retried += 1
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, deadline=deadline, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def get_stats(self):
+        """Get coalescing statistics"""
+        with self._lock:
+            return {
+                "executions": self._executions,
+                "coalesced": self._coalesced,
+                "retried": self._retried,
+                "in_flight": len(self._calls)
+            }
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The service's modules import each other by name and the shared modules from the backend directory
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+sys.path.append(os.path.dirname(SERVICE_DIR))
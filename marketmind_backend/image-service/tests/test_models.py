@@ -0,0 +1,257 @@
+"""
+Tests of the model backends and their registry.
+
+SDXL backends are tested on the CPU with a tiny randomly initialized pipeline injected through
+`pipeline_factory`, and LoRA weights saved the way the fine-tuning script saves them; these
+tests are skipped when torch, diffusers, transformers or peft are not installed.
+"""
+import io
+import json
+import time
+import base64
+import importlib.util
+
+import jwt
+import numpy
+import pytest
+import yaml
+from PIL import Image
+
+import models
+from models import FAILED, READY, MockBackend, ModelRegistry, ModelUnavailable, SdxlLoraBackend
+
+requires_diffusion = pytest.mark.skipif(
+    any(importlib.util.find_spec(name) is None for name in ('torch', 'diffusers', 'transformers', 'peft')),
+    reason="needs torch, diffusers, transformers and peft")
+
+LORA_RANK, LORA_ALPHA = 4, 8
+
+
+def tiny_components():
+    """Components of a tiny SDXL pipeline, the same for every call"""
+    import torch
+    from diffusers import AutoencoderKL, EulerDiscreteScheduler, UNet2DConditionModel
+    from transformers import CLIPTextConfig, CLIPTextModel, CLIPTextModelWithProjection
+
+    torch.manual_seed(0)
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64), layers_per_block=2, sample_size=32, in_channels=4, out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"), up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        attention_head_dim=(2, 4), use_linear_projection=True, addition_embed_type="text_time",
+        addition_time_embed_dim=8, transformer_layers_per_block=(1, 2),
+        projection_class_embeddings_input_dim=80,  # 6 time ids * 8 + the pooled text embedding
+        cross_attention_dim=64)
+    torch.manual_seed(0)
+    vae = AutoencoderKL(
+        block_out_channels=[32, 64], in_channels=3, out_channels=3, latent_channels=4, sample_size=128,
+        down_block_types=["DownEncoderBlock2D", "DownEncoderBlock2D"],
+        up_block_types=["UpDecoderBlock2D", "UpDecoderBlock2D"])
+    text_config = CLIPTextConfig(
+        bos_token_id=0, eos_token_id=2, pad_token_id=1, vocab_size=1000, hidden_size=32, intermediate_size=37,
+        num_attention_heads=4, num_hidden_layers=5, layer_norm_eps=1e-05, hidden_act="gelu", projection_dim=32)
+    torch.manual_seed(0)
+    text_encoder = CLIPTextModel(text_config)
+    torch.manual_seed(0)
+    text_encoder_2 = CLIPTextModelWithProjection(text_config)
+    scheduler = EulerDiscreteScheduler(
+        beta_start=0.00085, beta_end=0.012, beta_schedule="scaled_linear", steps_offset=1, timestep_spacing="leading")
+    return unet, vae, text_encoder, text_encoder_2, scheduler
+
+
+def tiny_tokenizer(directory):
+    """A CLIP tokenizer over single letters, enough to encode test prompts"""
+    from transformers import CLIPTokenizer
+
+    tokens = ["<|startoftext|>", "<|endoftext|>"]
+    tokens += [letter for letter in "abcdefghijklmnopqrstuvwxyz"] + [f"{letter}</w>" for letter in "abcdefghijklmnopqrstuvwxyz"]
+    vocab_file, merges_file = directory / "vocab.json", directory / "merges.txt"
+    vocab_file.write_text(json.dumps({token: index for index, token in enumerate(tokens)}))
+    merges_file.write_text("#version: 0.2\n")
+    return CLIPTokenizer(str(vocab_file), str(merges_file), model_max_length=77)
+
+
+@pytest.fixture
+def pipeline_factory(tmp_path_factory):
+    """Builds a tiny SDXL pipeline in place of downloading the base model"""
+    from diffusers import StableDiffusionXLPipeline
+
+    tokenizer = tiny_tokenizer(tmp_path_factory.mktemp("tokenizer"))
+
+    def factory(base_model, dtype, device):
+        unet, vae, text_encoder, text_encoder_2, scheduler = tiny_components()
+        pipeline = StableDiffusionXLPipeline(
+            vae=vae, text_encoder=text_encoder, text_encoder_2=text_encoder_2, tokenizer=tokenizer,
+            tokenizer_2=tokenizer, unet=unet, scheduler=scheduler, add_watermarker=False)
+        pipeline.set_progress_bar_config(disable=True)
+        # The tiny components are created in float32, the dtype the backend asks for on the CPU
+        return pipeline.to(device)
+
+    return factory
+
+
+def train_lora():
+    """The tiny UNet wrapped with LoRA adapters as the fine-tuning script does, with trained weights"""
+    import torch
+    from peft import LoraConfig, get_peft_model
+
+    unet = tiny_components()[0]
+    unet = get_peft_model(unet, LoraConfig(
+        r=LORA_RANK, lora_alpha=LORA_ALPHA, target_modules=SdxlLoraBackend.UNET_TARGET_MODULES,
+        lora_dropout=0.0, bias="none"))
+    # Adapters start as a no-op, training is what makes lora_B non-zero
+    torch.manual_seed(1)
+    for name, param in unet.named_parameters():
+        if "lora_B" in name:
+            torch.nn.init.normal_(param, std=0.5)
+    return unet
+
+
+def save_lora(directory, state_dict):
+    """A '<name>_final' directory as the fine-tuning script writes it"""
+    import torch
+
+    directory.mkdir()
+    torch.save(state_dict, directory / "unet_lora_state_dict.safetensors")
+    with open(directory / "config.yaml", "w") as f:
+        yaml.dump({
+            "model": {"name_or_path": "tiny-sdxl"},
+            "dtype": "fp32",
+            "config": {"network": {"linear": LORA_RANK, "linear_alpha": LORA_ALPHA}, "trigger_word": "lmao"},
+            "sample": {"neg": "blurry"}
+        }, f)
+    return directory
+
+
+@pytest.fixture
+def lora_dir(tmp_path):
+    """Trained UNet weights, named without the adapter name by peft's get_peft_model_state_dict"""
+    from peft import get_peft_model_state_dict
+
+    return save_lora(tmp_path / "lmao_final", get_peft_model_state_dict(train_lora()))
+
+
+def sdxl_backend(name, lora_dir, pipeline_factory):
+    return SdxlLoraBackend(name, str(lora_dir), device='cpu', steps=2, pipeline_factory=pipeline_factory)
+
+
+def generate(backend, prompt, width, height):
+    return backend.generate(prompt, width, height, lambda stage, **details: None)
+
+
+@requires_diffusion
+def test_lora_merge_changes_unet_weights(lora_dir, pipeline_factory):
+    backend = sdxl_backend("lmao", lora_dir, pipeline_factory)
+    backend.load()
+
+    base = tiny_components()[0].state_dict()
+    merged = backend.pipeline.unet.state_dict()
+    assert set(merged) == set(base)
+    changed = [name for name in base if not numpy.array_equal(base[name].numpy(), merged[name].numpy())]
+    assert changed
+    assert all(any(target in name for target in SdxlLoraBackend.UNET_TARGET_MODULES) for name in changed)
+    assert backend.trigger_word == "lmao" and backend.negative_prompt == "blurry"
+    assert backend.memory_bytes() > 0
+
+
+@requires_diffusion
+def test_lora_weights_named_after_the_adapter_load_too(tmp_path, pipeline_factory):
+    # The parameter names of the wrapped model include the adapter name, 'lora_A.default.weight'
+    unet = train_lora()
+    state_dict = {name: param.data.cpu().clone() for name, param in unet.named_parameters() if "lora" in name}
+    backend = sdxl_backend("lmao", save_lora(tmp_path / "lmao_final", state_dict), pipeline_factory)
+    backend.load()
+
+    merged = backend.pipeline.unet.state_dict()
+    expected = unet.merge_and_unload().state_dict()
+    assert all(numpy.allclose(expected[name].numpy(), merged[name].numpy(), atol=1e-6) for name in expected)
+
+
+@requires_diffusion
+def test_fixed_prompt_gives_deterministic_resized_image(lora_dir, pipeline_factory):
+    backend = sdxl_backend("lmao", lora_dir, pipeline_factory)
+    backend.load()
+
+    first = generate(backend, "a red car", 68, 76)
+    second = generate(backend, "a red car", 68, 76)
+    assert first.size == (68, 76) and first.mode == 'RGB'
+    assert numpy.array_equal(numpy.asarray(first), numpy.asarray(second))
+    assert not numpy.array_equal(numpy.asarray(first), numpy.asarray(generate(backend, "a blue boat", 68, 76)))
+
+
+@requires_diffusion
+def test_registry_reports_ready_and_failed_backends(lora_dir, pipeline_factory, tmp_path):
+    registry = ModelRegistry([
+        MockBackend(),
+        sdxl_backend("lmao", lora_dir, pipeline_factory),
+        sdxl_backend("broken", tmp_path / "missing_final", pipeline_factory),
+    ]).load_all()
+
+    stats = registry.get_stats()
+    assert stats["mock-generator"]["status"] == READY and stats["mock-generator"]["default"]
+    assert stats["lmao"]["status"] == READY and stats["lmao"]["memory_bytes"] > 0
+    assert stats["broken"]["status"] == FAILED and "config.yaml" in stats["broken"]["error"]
+    assert registry.get("lmao").version.startswith("sdxl-")
+    with pytest.raises(ModelUnavailable):
+        registry.get("broken")
+
+
+def test_failed_backend_is_unavailable_without_diffusion_packages(monkeypatch, tmp_path):
+    monkeypatch.setattr(models, 'torch', None)
+    registry = ModelRegistry([MockBackend(), SdxlLoraBackend("lmao", str(tmp_path))]).load_all()
+
+    assert registry.get_stats()["lmao"]["status"] == FAILED
+    assert registry.get().name == "mock-generator"
+    with pytest.raises(ModelUnavailable, match="failed to load"):
+        registry.get("lmao")
+
+
+@pytest.fixture
+def service(monkeypatch):
+    """The image service app with the registry under test swapped in, and a client sending a valid token"""
+    import app
+    import rendering
+
+    def use(registry):
+        monkeypatch.setattr(app, 'model_registry', registry)
+        monkeypatch.setattr(rendering, 'registry', registry)
+        token = jwt.encode({"user_id": "tester", "exp": time.time() + 60}, app.JWT_SECRET, algorithm='HS256')
+        client = app.app.test_client()
+        client.environ_base['HTTP_AUTHORIZATION'] = f"Bearer {token}"
+        return client
+
+    return use
+
+
+def decode(response):
+    return Image.open(io.BytesIO(base64.b64decode(response.get_json()["image"])))
+
+
+def test_failed_backend_answers_503_while_others_serve(service, monkeypatch, tmp_path):
+    monkeypatch.setattr(models, 'torch', None)
+    client = service(ModelRegistry([MockBackend(), SdxlLoraBackend("lmao", str(tmp_path))]).load_all())
+
+    response = client.post('/generate', json={"prompt": "a red car", "model": "lmao"})
+    assert response.status_code == 503
+    assert "lmao" in response.get_json()["error"]
+
+    response = client.post('/generate', json={"prompt": "a red car"})
+    assert response.status_code == 200 and response.get_json()["model"] == "mock-generator"
+
+    response = client.post('/generate', json={"prompt": "a red car", "model": "nonexistent"})
+    assert response.status_code == 400
+
+
+@requires_diffusion
+def test_model_field_picks_the_backend(service, lora_dir, pipeline_factory):
+    lmao = sdxl_backend("lmao", lora_dir, pipeline_factory)
+    client = service(ModelRegistry([MockBackend(), lmao]).load_all())
+
+    response = client.post('/generate', json={"prompt": "a red car", "width": 68, "height": 76, "model": "lmao"})
+    assert response.status_code == 200 and response.get_json()["model"] == "lmao"
+    image = decode(response)
+    assert image.size == (68, 76)
+    assert numpy.array_equal(numpy.asarray(image.convert('RGB')), numpy.asarray(generate(lmao, "a red car", 68, 76)))
+
+    response = client.post('/generate', json={"prompt": "a red car", "width": 68, "height": 76})
+    assert response.status_code == 200 and response.get_json()["model"] == "mock-generator"
+    assert not numpy.array_equal(numpy.asarray(decode(response).convert('RGB')), numpy.asarray(image.convert('RGB')))
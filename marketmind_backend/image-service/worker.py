@@ -0,0 +1,27 @@
+"""
+Standalone generation job worker.
+
+    JOB_BACKEND=redis JOB_WORKERS=4 python worker.py
+
+Consumes the same shared queue as the HTTP service, so rendering capacity
+scales separately from the API (run the service itself with JOB_WORKERS=0).
+"""
+import os
+import sys
+import time
+
+# Shared modules live next to the service directories (copied to /app/common in Docker)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import tracing
+from jobs import JOB_BACKEND, JOB_WORKERS, JobWorkerPool, make_store
+from models import registry
+
+if __name__ == '__main__':
+    if JOB_BACKEND != 'redis':
+        sys.exit("A standalone worker needs a shared queue, set JOB_BACKEND=redis")
+    tracing.init_tracer('image-worker')
+    registry.load_all()
+    pool = JobWorkerPool(make_store(), workers=max(1, JOB_WORKERS)).start()
+    print(f"Running {pool.workers} job workers")
+    while True:
+        time.sleep(60)
@@ -1,5 +1,15 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+from werkzeug.serving import WSGIRequestHandler
+import os
+import sys
+from datetime import datetime
+
+# Shared modules live next to the service directories (copied to /app/common in Docker)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import deadline
+from common.metrics import Metrics
+from common import tracing
 from models import User
 from database import db
 from auth import (
@@ -10,10 +20,9 @@ from auth import (
     google_login,
     verify_password,
     generate_token,
-    verify_token
+    load_user,
+    require_auth
 )
-import os
-from datetime import datetime
 
 app = Flask(__name__)
 # CORS(app)
@@ -23,6 +32,17 @@ CORS(app, resources={r"/*": {"origins": "http://localhost:3000"}}, supports_cred
 
 users_collection = db.get_collection('users')  # Add this line
 
+# Request count, errors, in-flight and latency per route, served at /metrics
+metrics = Metrics('user-service').init_app(app)
+
+# Server span per request, continuing the gateway's trace
+tracing.init_app(app, tracing.init_tracer('user-service'))
+
+# Requests that waited past their deadline are answered 504 without touching the database
+deadline_exceeded = metrics.counter(
+    'deadline_exceeded_total', 'Requests dropped because their deadline passed', ('service', 'stage'))
+deadline.init_app(app, on_expired=lambda stage: deadline_exceeded.inc(service='user-service', stage=stage))
+
 
 # Configure MongoDB
 # app.config["MONGO_URI"] = os.environ.get("MONGO_URI", "mongodb://mongo:27017/user_service")
@@ -43,7 +63,8 @@ def signup():
                 return jsonify({"message": f"Missing required field: {field}"}), 400
 
         # Check if user exists using PyMongo
-        existing_user = users_collection.find_one({"email": data["email"]})
+        with tracing.span('mongo.find_one', collection='users'):
+            existing_user = users_collection.find_one({"email": data["email"]})
         if existing_user:
             return jsonify({"message": "Email already registered"}), 409
 
@@ -76,7 +97,8 @@ def login():
     
     try:
         # Find user by email using PyMongo
-        user_data = users_collection.find_one({"email": data["email"]})
+        with tracing.span('mongo.find_one', collection='users'):
+            user_data = users_collection.find_one({"email": data["email"]})
         
         if not user_data:
             return jsonify({"message": "Invalid email or password"}), 401
@@ -88,7 +110,9 @@ def login():
         user = User.from_dict(user_data)
         
         # Verify password
-        if not verify_password(data["password"], user.password_hash):
+        with tracing.span('verify_password'):
+            password_ok = verify_password(data["password"], user.password_hash)
+        if not password_ok:
             return jsonify({"message": "Invalid email or password"}), 401
         
         # Generate token with user ID
@@ -113,31 +137,21 @@ def login():
     
 
 @app.route("/me", methods=["GET"])
+@require_auth
 def get_current_user():
-    auth_header = request.headers.get("Authorization")
-    
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return jsonify({"message": "Authorization header required"}), 401
-    
-    token = auth_header.split(" ")[1]
-    user_id = verify_token(token)
-    
-    if not user_id:
-        return jsonify({"message": "Invalid or expired token"}), 401
-    
-    user = User.objects(id=user_id).first()
+    user = load_user(request.user_id)
     
     if not user:
         return jsonify({"message": "User not found"}), 404
     
     return jsonify({
-        "id": str(user.id),
+        "id": str(user._id),
         "email": user.email,
         "name": user.username,
-        "profilePicture": user.profile_picture,
-        "provider": user.provider,
-        "createdAt": user.created_at.isoformat(),
-        "updatedAt": user.updated_at.isoformat()
+        "profilePicture": user.profile_image,
+        "provider": user.auth_provider,
+        "createdAt": user.created_at,
+        "updatedAt": user.updated_at
     })
 
 @app.route("/logout", methods=["POST"])
@@ -168,4 +182,6 @@ def handle_facebook_callback():
 
 
 if __name__ == "__main__":
+    # Speak HTTP/1.1 so the gateway can keep connections alive between requests
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"
     app.run(host="0.0.0.0", port=5001)
\ No newline at end of file
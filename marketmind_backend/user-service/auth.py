@@ -9,9 +9,11 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from bson import ObjectId  # Add this import
 from database import Database
 from models import User
+from common.identity import IDENTITY_HEADER, verify_identity
+from common import tracing
 
 # JWT Configuration
-JWT_SECRET = ''  # Set this to your secret key
+JWT_SECRET = os.environ.get('JWT_SECRET', '')  # Set this to your secret key
 JWT_EXPIRATION_HOURS = 24
 SERVICE_BASE_URL = os.environ.get('SERVICE_BASE_URL', 'http://localhost:8000')
 
@@ -46,7 +48,8 @@ def create_user(email, password=None, name=None, provider="local", profile_pictu
         "created_at": datetime.utcnow(),
         "updated_at": datetime.utcnow()
     }
-    result = users_collection.insert_one(user_data)
+    with tracing.span('mongo.insert_one', collection='users'):
+        result = users_collection.insert_one(user_data)
     user_data["_id"] = result.inserted_id  # Store as ObjectId
     return User.from_dict(user_data)
 
@@ -58,19 +61,36 @@ def generate_token(user_id):
     }
     return jwt.encode(payload, JWT_SECRET, algorithm='HS256')
 
-def authenticate_user():
-    """Retrieve user from JWT token"""
-    token = get_token_from_request()
-    if not token:
+def verify_token(token):
+    """Decode a JWT token and return its user ID, or None if invalid or expired"""
+    try:
+        with tracing.span('verify_token'):
+            payload = jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
+        return payload.get('user_id')
+    except (jwt.ExpiredSignatureError, jwt.InvalidTokenError):
         return None
 
+def authenticated_user_id():
+    """User ID asserted by the gateway, or from the JWT token for direct calls"""
+    identity = verify_identity(request.headers.get(IDENTITY_HEADER))
+    if identity is not None:
+        return identity.get('user_id')
+    token = get_token_from_request()
+    return verify_token(token) if token else None
+
+def load_user(user_id):
+    """Fetch a user by ID"""
     try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
-        user_id = ObjectId(payload['user_id'])  # Convert back to ObjectId
-        user_data = users_collection.find_one({'_id': user_id})
-        return User.from_dict(user_data) if user_data else None
-    except (jwt.ExpiredSignatureError, jwt.InvalidTokenError, ValueError):
+        with tracing.span('mongo.find_one', collection='users'):
+            user_data = users_collection.find_one({'_id': ObjectId(user_id)})  # Convert back to ObjectId
+    except Exception:
         return None
+    return User.from_dict(user_data) if user_data else None
+
+def authenticate_user():
+    """Retrieve user from the gateway identity or JWT token"""
+    user_id = authenticated_user_id()
+    return load_user(user_id) if user_id else None
 
 # --- OAuth Common Functions ---
 def handle_oauth_callback(provider, user_info_func):
@@ -86,10 +106,11 @@ def handle_oauth_callback(provider, user_info_func):
         user_info = user_info_func()
         
         # Find or create user
-        existing_user = users_collection.find_one({
-            "auth_provider": provider,
-            "auth_provider_id": user_info['id']
-        })
+        with tracing.span('mongo.find_one', collection='users'):
+            existing_user = users_collection.find_one({
+                "auth_provider": provider,
+                "auth_provider_id": user_info['id']
+            })
         
         if existing_user:
             user = User.from_dict(existing_user)
@@ -185,11 +206,12 @@ def get_token_from_request():
 
 # --- Decorators ---
 def require_auth(f):
+    """Set request.user_id without a database lookup, views call load_user() when they need the profile"""
     def decorated(*args, **kwargs):
-        user = authenticate_user()
-        if not user:
+        user_id = authenticated_user_id()
+        if not user_id:
             return jsonify({"error": "Authentication required"}), 401
-        request.current_user = user
+        request.user_id = user_id
         return f(*args, **kwargs)
     decorated.__name__ = f.__name__
     return decorated
\ No newline at end of file